@@ -1,14 +1,24 @@
 # bot.py
 import asyncio
 import logging
+from multiprocessing.connection import Connection
+from typing import Optional
+
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import Config
-from database.database import Database
+from db.database import db
 from services.chat_manager import ChatManager
+from services.fsm_storage import PostgresStorage
+from services.avatar_renderer import AvatarRenderer
+from services.avatar_delivery import AvatarDelivery
+from services.message_ingest import MessageIngest
+from services.send_queue import SendQueue
+from services.sharding import ShardFront, ShardWorker
+from services.webhook_server import WebhookServer
+from utils.avatars import avatar_store
 from handlers import main_router
 
 # Настройка логирования
@@ -19,18 +29,49 @@ logger = logging.getLogger(__name__)
 class NOISBot:
     def __init__(self):
         self.config = Config()
-        self.storage = MemoryStorage()
+        self.db = db
+        # Состояния диалогов переживают перезапуск и общие для всех процессов.
+        # Кеш выключен только для webhook без шардинга: там экземпляров за
+        # балансировщиком может быть несколько, и апдейты пользователя приходят в разные
+        self.storage = PostgresStorage(self.db, cache_ttl=0 if self.config.multi_instance else 60.0)
         self.bot = Bot(
             token=self.config.BOT_TOKEN,
             default=DefaultBotProperties(parse_mode=ParseMode.HTML)
         )
         self.dp = Dispatcher(storage=self.storage)
-        self.db = Database()
-        self.chat_manager = ChatManager(self.bot, self.db)
+        # Лимит бота на отправку общий - воркеры делят его поровну
+        self.send_queue = SendQueue(self.bot, global_rate=30.0 / max(1, self.config.SHARD_WORKERS))
+        self.chat_manager = ChatManager(self.bot, self.db, self.send_queue)
+        # Ядра для рендера тоже общие: у каждого воркера свой пул процессов
+        self.avatar_renderer = AvatarRenderer(shards=self.config.SHARD_WORKERS)
+        self.avatar_delivery = AvatarDelivery(self.bot, self.db, self.avatar_renderer, self.send_queue)
+        self.message_ingest = MessageIngest(self.db)
 
     async def setup_dependencies(self):
         """Инициализация зависимостей и передача в обработчики"""
-        await self.db.connect()
+        await self.db.connect(self.config.DB_URL)
+        await asyncio.to_thread(avatar_store.load)
+        await self.db.load_taken_nicknames()
+        # Индекс членства не видит вступлений, обработанных другими процессами,
+        # поэтому он включен, только когда процесс один: polling без шардинга
+        if not self.config.multi_instance and self.config.SHARD_WORKERS <= 1:
+            await self.db.load_membership()
+
+        # Рендер и отправка аватарок доступны в обработчиках как аргументы
+        self.dp["avatar_renderer"] = self.avatar_renderer
+        self.dp["avatar_delivery"] = self.avatar_delivery
+
+        # Исходящие сообщения идут через очередь с лимитами Telegram
+        self.send_queue.start()
+        self.dp["send_queue"] = self.send_queue
+
+        # Сообщения комнат пишутся в БД пачками
+        self.message_ingest.start()
+        self.dp["message_ingest"] = self.message_ingest
+
+        # Занятые ники для generate_unique_nicks без запроса к БД на каждый ник;
+        # Database обновляет их при регистрации и смене ника во всех процессах
+        self.dp["taken_nicknames"] = self.db.taken_nicknames
 
         # Инициализируем обработчики с зависимостями
         from handlers.start import setup_start_handlers
@@ -41,28 +82,83 @@ class NOISBot:
         setup_room_handlers(main_router, self.db, self.chat_manager)
         setup_message_handlers(main_router, self.db, self.chat_manager)
 
-    async def start(self):
-        """Запуск бота"""
+    async def start(self, updates: Optional[Connection] = None, shard: int = 0):
+        """
+        Запуск бота
+
+        Args:
+            updates: Канал апдейтов от фронта, если бот запущен воркером шарда
+            shard: Номер шарда воркера
+        """
         try:
             logger.info("Инициализация NOIS бота...")
 
             await self.setup_dependencies()
             self.dp.include_router(main_router)
 
-            logger.info("Бот запускается...")
-            await self.dp.start_polling(self.bot)
+            if updates is not None:
+                await ShardWorker(self.bot, self.dp, updates, shard).run()
+            elif self.config.RUN_MODE == "webhook":
+                logger.info("Бот запускается в режиме webhook...")
+                await create_webhook_server(self.config, self.bot, self.dp).run()
+            else:
+                logger.info("Бот запускается...")
+                await self.dp.start_polling(self.bot)
 
         except Exception as e:
             logger.error(f"Ошибка запуска: {e}")
             raise
         finally:
+            await self.chat_manager.broadcaster.close()
+            await self.avatar_renderer.close()
+            # Буфер сообщений дописывается до закрытия пула
+            await self.message_ingest.close()
             await self.db.disconnect()
+            # Очередь дописывает отправки, пока сессия бота открыта
+            await self.send_queue.close()
             await self.bot.session.close()
 
 
+def create_webhook_server(config: Config, bot: Bot, dp: Dispatcher) -> WebhookServer:
+    return WebhookServer(
+        bot, dp,
+        base_url=config.WEBHOOK_BASE_URL,
+        secret=config.WEBHOOK_SECRET,
+        path=config.WEBHOOK_PATH,
+        host=config.WEBHOOK_HOST,
+        port=config.WEBHOOK_PORT,
+        max_concurrent=config.WEBHOOK_MAX_CONCURRENT,
+    )
+
+
+def run_shard_worker(shard: int, updates: Connection):
+    """Точка входа процесса-воркера (services/sharding.py)"""
+    asyncio.run(NOISBot().start(updates, shard))
+
+
+async def run_shard_front(config: Config):
+    """Прием апдейтов и раздача их воркерам по пользователю"""
+    bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    front = ShardFront(run_shard_worker, config.SHARD_WORKERS, max_queued=config.SHARD_MAX_QUEUED)
+    try:
+        if config.RUN_MODE == "webhook":
+            logger.info(f"Бот запускается в режиме webhook, воркеров: {config.SHARD_WORKERS}...")
+            await create_webhook_server(config, bot, front).run()
+        else:
+            logger.info(f"Бот запускается, воркеров: {config.SHARD_WORKERS}...")
+            # Апдейты раздаются по одному, чтобы воркер получал их в порядке Telegram
+            await front.start_polling(bot, handle_as_tasks=False)
+    finally:
+        await bot.session.close()
+
+
 async def main():
-    bot = NOISBot()
-    await bot.start()
+    config = Config()
+    if config.SHARD_WORKERS > 1:
+        await run_shard_front(config)
+    else:
+        bot = NOISBot()
+        await bot.start()
 
 
 if __name__ == "__main__":
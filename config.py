@@ -11,12 +11,65 @@ class Config:
         self.DB_URL = self._get_env_var("DB_URL")
         self.ADMIN_IDS = self._get_admin_ids()
 
+        # Пул соединений с БД
+        self.DB_POOL_MIN_SIZE = self._get_int_var("DB_POOL_MIN_SIZE", 2)
+        self.DB_POOL_MAX_SIZE = self._get_int_var("DB_POOL_MAX_SIZE", 10)
+        self.DB_COMMAND_TIMEOUT = self._get_float_var("DB_COMMAND_TIMEOUT", 10.0)
+        self.DB_ACQUIRE_TIMEOUT = self._get_float_var("DB_ACQUIRE_TIMEOUT", 5.0)
+        self.DB_MAX_INACTIVE_LIFETIME = self._get_float_var("DB_MAX_INACTIVE_LIFETIME", 300.0)
+        self.DB_STATEMENT_CACHE_SIZE = self._get_int_var("DB_STATEMENT_CACHE_SIZE", 256)
+
+        # Режим получения апдейтов: polling или webhook
+        self.RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+        if self.RUN_MODE == "webhook":
+            self.WEBHOOK_BASE_URL = self._get_env_var("WEBHOOK_BASE_URL")
+            self.WEBHOOK_SECRET = self._get_env_var("WEBHOOK_SECRET")
+        self.WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+        self.WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+        self.WEBHOOK_PORT = self._get_int_var("WEBHOOK_PORT", 8080)
+        self.WEBHOOK_MAX_CONCURRENT = self._get_int_var("WEBHOOK_MAX_CONCURRENT", 100)
+
+        # Обработка в нескольких процессах: больше 1 - апдейты делятся между
+        # воркерами по пользователю. Каждый воркер открывает свой пул БД
+        # с настройками выше, поэтому соединений будет до SHARD_WORKERS * DB_POOL_MAX_SIZE
+        self.SHARD_WORKERS = self._get_int_var("SHARD_WORKERS", 1)
+        self.SHARD_MAX_QUEUED = self._get_int_var("SHARD_MAX_QUEUED", 1000)
+
+    @property
+    def multi_instance(self) -> bool:
+        """
+        Апдейты одного пользователя могут обрабатывать разные процессы без
+        общего фронта: webhook без шардинга (экземпляры за балансировщиком).
+        Polling всегда один, а при шардинге пользователь закреплен за воркером.
+        """
+        return self.RUN_MODE == "webhook" and self.SHARD_WORKERS <= 1
+
     def _get_env_var(self, var_name: str) -> str:
         value = os.getenv(var_name)
         if not value:
             raise ValueError(f"Переменная окружения {var_name} не установлена")
         return value
 
+    def _get_int_var(self, var_name: str, default: int) -> int:
+        value = os.getenv(var_name)
+        if not value:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            print(f"⚠️ Ошибка парсинга {var_name}. Использую {default}.")
+            return default
+
+    def _get_float_var(self, var_name: str, default: float) -> float:
+        value = os.getenv(var_name)
+        if not value:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            print(f"⚠️ Ошибка парсинга {var_name}. Использую {default}.")
+            return default
+
     def _get_admin_ids(self) -> list[int]:
         admin_ids_str = os.getenv("ADMIN_IDS", "")
         if not admin_ids_str:
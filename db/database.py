@@ -1,23 +1,126 @@
-# database/database.py
-import asyncpg
+# db/database.py
+import asyncio
+import json
 import logging
-from typing import List, Dict, Optional, Any
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import asyncpg
+
+from db.migrations import migrate
+from db.queries import QUERIES, PreparedConnection, QueryStats, prepare_queries
+from utils.cache import AsyncCache, MembershipIndex
+from utils.nick_generator import TakenNicknames
 
 logger = logging.getLogger(__name__)
 
+ConnectionHook = Callable[[asyncpg.Connection], Awaitable[None]]
+
+# Канал NOTIFY, по которому процессы бота сообщают друг другу о смене ников и профилей
+USERS_CHANNEL = "nois_users"
+
+# Колонки, которые заполняет пакетная запись сообщений (insert_messages)
+MESSAGE_COLUMNS = ("message_id", "room_id", "user_id", "telegram_message_id",
+                   "message_text", "user_color_hex", "user_nickname")
+
+
+class MessageCursor(NamedTuple):
+    """Позиция в истории комнаты: сообщения упорядочены по (created_at, message_id)"""
+    created_at: datetime
+    message_id: int
+
+    @classmethod
+    def of(cls, message: Dict) -> "MessageCursor":
+        return cls(message["created_at"], message["message_id"])
+
+
+class RoomCursor(NamedTuple):
+    """Позиция в каталоге комнат: комнаты упорядочены по (created_at, room_id)"""
+    created_at: datetime
+    room_id: int
+
+    @classmethod
+    def of(cls, room: Dict) -> "RoomCursor":
+        return cls(room["created_at"], room["room_id"])
+
+
+class PoolStats:
+    """Счетчики ожидания соединений из пула"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.timeouts = 0
+        self.connections_opened = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "connections_opened": self.connections_opened,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
 
 class Database:
+    """
+    Единственный слой доступа к БД.
+
+    Размеры пула, таймауты и кеш выражений берутся из Config. Каждое новое
+    соединение проходит через хуки из add_connection_hook (первым -
+    подготовка запросов из db.queries), каждое получение соединения из
+    пула учитывается в stats (время ожидания и таймауты), каждый запрос
+    реестра - в query_stats.
+    """
+
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
-
-    async def connect(self):
+        self.acquire_timeout: Optional[float] = None
+        self.stats = PoolStats()
+        self.query_stats = QueryStats()
+        # Профили пользователей нужны на каждое сообщение - читаем из памяти;
+        # изменения профиля в других процессах сбрасывают запись через NOTIFY
+        self.user_cache = AsyncCache(ttl=300.0, max_size=50000)
+        # Членство в комнатах (до load_membership запросы идут в БД)
+        self.membership = MembershipIndex()
+        # Занятые ники (после load_taken_nicknames обновляются при записи пользователей)
+        self.taken_nicknames = TakenNicknames()
+        self._connection_hooks: List[ConnectionHook] = [prepare_queries]
+        self._db_url: Optional[str] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._instance_id = f"{os.getpid()}:{id(self)}"
+
+    async def connect(self, db_url: Optional[str] = None):
         """Подключение к базе данных"""
         try:
             from config import Config
             config = Config()
 
-            self.pool = await asyncpg.create_pool(config.DB_URL)
-            logger.info("✅ Успешное подключение к БД")
+            db_url = self._db_url = db_url or config.DB_URL
+
+            # Схема нужна до открытия пула: соединения сразу готовят запросы к таблицам
+            await self.initialize_tables(db_url)
+
+            self.acquire_timeout = config.DB_ACQUIRE_TIMEOUT
+            self.pool = await asyncpg.create_pool(
+                db_url,
+                min_size=config.DB_POOL_MIN_SIZE,
+                max_size=config.DB_POOL_MAX_SIZE,
+                command_timeout=config.DB_COMMAND_TIMEOUT,
+                max_inactive_connection_lifetime=config.DB_MAX_INACTIVE_LIFETIME,
+                statement_cache_size=config.DB_STATEMENT_CACHE_SIZE,
+                server_settings={"application_name": "nois-bot"},
+                init=self._init_connection,
+                connection_class=PreparedConnection,
+            )
+            logger.info(
+                f"✅ Успешное подключение к БД (пул {config.DB_POOL_MIN_SIZE}-{config.DB_POOL_MAX_SIZE})"
+            )
 
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к БД: {e}")
@@ -25,201 +128,451 @@ class Database:
 
     async def disconnect(self):
         """Закрытие соединения с БД"""
+        if self._listener:
+            listener, self._listener = self._listener, None
+            await listener.close()
+        if self.pool:
+            pool, self.pool = self.pool, None
+            await pool.close()
+            logger.info(f"✅ Соединение с БД закрыто, статистика пула: {self.stats.as_dict()}")
+
+    def add_connection_hook(self, hook: ConnectionHook):
+        """Регистрирует корутину, которая выполняется для каждого нового соединения пула"""
+        self._connection_hooks.append(hook)
+
+    async def _init_connection(self, conn: asyncpg.Connection):
+        self.stats.connections_opened += 1
+        for hook in self._connection_hooks:
+            await hook(conn)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[asyncpg.Connection]:
+        """Соединение из пула с учетом времени ожидания"""
+        started = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            logger.warning(
+                f"⚠️ Нет свободного соединения за {self.acquire_timeout} с "
+                f"(пул {self.pool.get_size()}, свободно {self.pool.get_idle_size()})"
+            )
+            raise
+
+        wait = time.perf_counter() - started
+        self.stats.acquired += 1
+        self.stats.total_wait += wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def health_check(self, timeout: float = 2.0) -> bool:
+        """Проверка, что БД отвечает и пул выдает соединения"""
+        if not self.pool:
+            return False
+        try:
+            async with self.acquire() as conn:
+                return await conn.fetchval("SELECT 1", timeout=timeout) == 1
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"⚠️ Проверка БД не прошла: {e}")
+            return False
+
+    def pool_status(self) -> Dict[str, Any]:
+        """Размер пула и счетчики ожидания для диагностики"""
+        status = self.stats.as_dict()
+        status["user_cache"] = self.user_cache.stats
+        status["membership"] = self.membership.stats
         if self.pool:
-            await self.pool.close()
-            logger.info("✅ Соединение с БД закрыто")
+            status.update(size=self.pool.get_size(), idle=self.pool.get_idle_size(),
+                          min_size=self.pool.get_min_size(), max_size=self.pool.get_max_size())
+        return status
+
+    async def _run(self, name: str, method: str, *args) -> Any:
+        """Выполняет запрос реестра и учитывает его время в query_stats"""
+        async with self.acquire() as conn:
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = await self._call(conn, name, method, args)
+                failed = False
+                return result
+            finally:
+                self.query_stats.record(name, started, failed)
+
+    @staticmethod
+    async def _call(conn: PreparedConnection, name: str, method: str, args: tuple) -> Any:
+        statement = conn.prepared.get(name)
+        if statement is None:
+            return await getattr(conn, method)(QUERIES[name].sql, *args)
+
+        # У подготовленного запроса нет execute - его заменяет fetch
+        method = "fetch" if method == "execute" else method
+        try:
+            return await getattr(statement, method)(*args)
+        except asyncpg.InvalidCachedStatementError:
+            # Схема изменилась после подготовки - готовим заново
+            conn.prepared[name] = statement = await conn.prepare(QUERIES[name].sql)
+            return await getattr(statement, method)(*args)
+
+    async def _execute(self, name: str, *args) -> None:
+        await self._run(name, "execute", *args)
+
+    async def _fetch(self, name: str, *args) -> List[asyncpg.Record]:
+        return await self._run(name, "fetch", *args)
+
+    async def _fetchrow(self, name: str, *args) -> Optional[asyncpg.Record]:
+        return await self._run(name, "fetchrow", *args)
+
+    async def _fetchval(self, name: str, *args) -> Any:
+        return await self._run(name, "fetchval", *args)
 
     async def execute(self, query: str, *args) -> None:
         """Выполнение запроса без возврата результата"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute(query, *args)
 
     async def fetch(self, query: str, *args) -> List[asyncpg.Record]:
         """Выполнение запроса с возвратом нескольких строк"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             return await conn.fetch(query, *args)
 
     async def fetchrow(self, query: str, *args) -> Optional[asyncpg.Record]:
         """Выполнение запроса с возвратом одной строки"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             return await conn.fetchrow(query, *args)
 
     async def fetchval(self, query: str, *args) -> Any:
         """Выполнение запроса с возвратом одного значения"""
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             return await conn.fetchval(query, *args)
 
     # ===== МЕТОДЫ ДЛЯ РАБОТЫ С ПОЛЬЗОВАТЕЛЯМИ =====
 
     async def create_user(self, user_id: int, nickname: str, color_hex: str) -> None:
         """Создание нового пользователя"""
-        query = """
-        INSERT INTO users (user_id, nickname, color_hex, created_at) 
-        VALUES ($1, $2, $3, NOW())
-        ON CONFLICT (user_id) DO UPDATE SET 
-            nickname = EXCLUDED.nickname,
-            color_hex = EXCLUDED.color_hex
-        """
-        await self.execute(query, user_id, nickname, color_hex)
+        old_nickname = await self._fetchval("create_user", user_id, nickname, color_hex)
+        self.user_cache.invalidate(user_id)
+        await self._user_changed(user_id, nickname, old_nickname)
 
     async def get_user(self, user_id: int) -> Optional[Dict]:
-        """Получение пользователя по ID"""
-        query = "SELECT * FROM users WHERE user_id = $1"
-        row = await self.fetchrow(query, user_id)
+        """Получение пользователя по ID (через кеш профилей)"""
+        user = await self.user_cache.get(user_id, self._load_user)
+        # Копия: изменения у вызывающего не должны попасть в кеш
+        return dict(user) if user else None
+
+    async def _load_user(self, user_id: int) -> Optional[Dict]:
+        row = await self._fetchrow("get_user", user_id)
         return dict(row) if row else None
 
     async def get_user_by_nickname(self, nickname: str) -> Optional[Dict]:
         """Получение пользователя по никнейму"""
-        query = "SELECT * FROM users WHERE nickname = $1"
-        row = await self.fetchrow(query, nickname)
+        row = await self._fetchrow("get_user_by_nickname", nickname)
         return dict(row) if row else None
 
+    async def iter_users(self, batch_size: int = 1000,
+                         after_user_id: Optional[int] = None) -> AsyncIterator[List[Dict]]:
+        """Постраничный обход всех пользователей по возрастанию user_id"""
+        last_user_id = after_user_id if after_user_id is not None else -2 ** 63
+        while True:
+            rows = await self._fetch("iter_users", last_user_id, batch_size)
+            if not rows:
+                return
+            yield [dict(row) for row in rows]
+            last_user_id = rows[-1]["user_id"]
+
+    async def get_users_count(self) -> int:
+        """Получение количества пользователей"""
+        return await self._fetchval("get_users_count")
+
     async def update_user_nickname(self, user_id: int, new_nickname: str) -> None:
         """Обновление никнейма пользователя"""
-        query = "UPDATE users SET nickname = $1 WHERE user_id = $2"
-        await self.execute(query, new_nickname, user_id)
+        old_nickname = await self._fetchval("update_user_nickname", new_nickname, user_id)
+        self.user_cache.invalidate(user_id)
+        if old_nickname is not None:
+            await self._user_changed(user_id, new_nickname, old_nickname)
+
+    async def load_taken_nicknames(self, batch_size: int = 5000):
+        """
+        Загрузка занятых ников в память (один раз, до обработки апдейтов).
+
+        Дальше множество обновляют create_user и update_user_nickname,
+        а изменения из других процессов приходят через LISTEN/NOTIFY.
+        Подписка оформляется до загрузки, чтобы не пропустить смену ника;
+        по ней же другие процессы сбрасывают профиль из user_cache.
+        """
+        self._listener = await asyncpg.connect(self._db_url)
+        await self._listener.add_listener(USERS_CHANNEL, self._on_user_notify)
+        self._listener.add_termination_listener(
+            lambda conn: logger.warning("⚠️ Подписка на изменения пользователей потеряна, "
+                                        "занятые ники и кеш профилей могут устареть")
+        )
+
+        self.taken_nicknames.clear()
+        await self.taken_nicknames.load(self, batch_size)
+        logger.info(f"✅ Занятые ники загружены: {len(self.taken_nicknames)}")
+
+    async def _user_changed(self, user_id: int, nickname: Optional[str] = None,
+                            old_nickname: Optional[str] = None):
+        """Применяет смену ника и сообщает другим процессам, что профиль изменился"""
+        change = {"source": self._instance_id, "user": user_id}
+        if nickname is not None and nickname != old_nickname:
+            self._apply_nickname_change(nickname, old_nickname)
+            change.update(add=nickname, discard=old_nickname)
+        if self._listener:
+            await self._execute("notify_user_change", USERS_CHANNEL, json.dumps(change, ensure_ascii=False))
+
+    def _apply_nickname_change(self, nickname: str, old_nickname: Optional[str]):
+        self.taken_nicknames.add(nickname)
+        if old_nickname is not None:
+            self.taken_nicknames.discard(old_nickname)
+
+    def _on_user_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            return
+        if change.get("source") == self._instance_id:
+            return
+        if change.get("user") is not None:
+            self.user_cache.invalidate(change["user"])
+        if change.get("add"):
+            self._apply_nickname_change(change["add"], change.get("discard"))
 
     async def update_user_color(self, user_id: int, new_color: str) -> None:
         """Обновление цвета пользователя"""
-        query = "UPDATE users SET color_hex = $1 WHERE user_id = $2"
-        await self.execute(query, new_color, user_id)
+        await self._execute("update_user_color", new_color, user_id)
+        self.user_cache.invalidate(user_id)
+        await self._user_changed(user_id)
 
     # ===== МЕТОДЫ ДЛЯ РАБОТЫ С КОМНАТАМИ =====
 
     async def create_room(self, name: str, created_by: int, is_public: bool = True,
                           password: Optional[str] = None, max_participants: int = 50) -> int:
         """Создание новой комнаты"""
-        query = """
-        INSERT INTO rooms (name, created_by, is_public, password, max_participants, created_at)
-        VALUES ($1, $2, $3, $4, $5, NOW())
-        RETURNING room_id
-        """
-        room_id = await self.fetchval(query, name, created_by, is_public, password, max_participants)
+        room_id = await self._fetchval("create_room", name, created_by, is_public, password, max_participants)
         return room_id
 
     async def get_room(self, room_id: int) -> Optional[Dict]:
         """Получение комнаты по ID"""
-        query = """
-        SELECT r.*, u.nickname as creator_nickname
-        FROM rooms r 
-        LEFT JOIN users u ON r.created_by = u.user_id 
-        WHERE r.room_id = $1
-        """
-        row = await self.fetchrow(query, room_id)
+        row = await self._fetchrow("get_room", room_id)
         return dict(row) if row else None
 
-    async def get_public_rooms(self) -> List[Dict]:
-        """Получение списка публичных комнат"""
-        query = """
-        SELECT r.*, u.nickname as creator_nickname,
-               COUNT(ru.user_id) as participants_count
-        FROM rooms r 
-        LEFT JOIN users u ON r.created_by = u.user_id 
-        LEFT JOIN room_users ru ON r.room_id = ru.room_id 
-        WHERE r.is_public = true 
-        GROUP BY r.room_id, u.nickname 
-        ORDER BY r.created_at DESC
+    async def get_public_rooms(self, limit: int = 20, before: Optional[RoomCursor] = None) -> List[Dict]:
         """
-        rows = await self.fetch(query)
+        Страница каталога публичных комнат, новые первыми.
+        Следующая страница - before=RoomCursor.of(последняя комната страницы).
+        """
+        if before is not None:
+            rows = await self._fetch("get_public_rooms_before", *before, limit)
+        else:
+            rows = await self._fetch("get_public_rooms", limit)
+        return [dict(row) for row in rows]
+
+    async def get_top_public_rooms(self, limit: int = 10) -> List[Dict]:
+        """Публичные комнаты с наибольшим числом участников"""
+        rows = await self._fetch("get_top_public_rooms", limit)
         return [dict(row) for row in rows]
 
-    async def get_user_rooms(self, user_id: int) -> List[Dict]:
-        """Получение комнат пользователя"""
-        query = """
-        SELECT r.*, u.nickname as creator_nickname
-        FROM rooms r 
-        LEFT JOIN users u ON r.created_by = u.user_id 
-        INNER JOIN room_users ru ON r.room_id = ru.room_id 
-        WHERE ru.user_id = $1 
-        ORDER BY ru.joined_at DESC
+    async def get_public_rooms_count(self) -> int:
+        """Получение количества публичных комнат"""
+        return await self._fetchval("get_public_rooms_count")
+
+    async def get_user_rooms(self, user_id: int, limit: int = 100, preview_length: int = 100) -> List[Dict]:
         """
-        rows = await self.fetch(query, user_id)
+        Комнаты пользователя, последние вошедшие первыми.
+
+        У каждой комнаты есть participants_count и превью последнего
+        сообщения: last_message_text (первые preview_length символов),
+        last_message_nickname, last_message_at (None, если сообщений нет).
+        """
+        rows = await self._fetch("get_user_rooms", user_id, preview_length, limit)
         return [dict(row) for row in rows]
 
     async def get_user_rooms_count(self, user_id: int) -> int:
         """Получение количества комнат пользователя"""
-        query = "SELECT COUNT(*) FROM room_users WHERE user_id = $1"
-        return await self.fetchval(query, user_id)
+        if self.membership.loaded:
+            return self.membership.user_rooms_count(user_id)
+        return await self._fetchval("get_user_rooms_count", user_id)
 
     async def add_user_to_room(self, user_id: int, room_id: int) -> None:
         """Добавление пользователя в комнату"""
-        query = """
-        INSERT INTO room_users (user_id, room_id, joined_at) 
-        VALUES ($1, $2, NOW())
-        ON CONFLICT (user_id, room_id) DO NOTHING
-        """
-        await self.execute(query, user_id, room_id)
+        await self._execute("add_user_to_room", user_id, room_id)
+        self.membership.add(user_id, room_id)
 
     async def remove_user_from_room(self, user_id: int, room_id: int) -> None:
         """Удаление пользователя из комнаты"""
-        query = "DELETE FROM room_users WHERE user_id = $1 AND room_id = $2"
-        await self.execute(query, user_id, room_id)
+        await self._execute("remove_user_from_room", user_id, room_id)
+        self.membership.remove(user_id, room_id)
+
+    async def load_membership(self, batch_size: int = 10000):
+        """Загрузка членства в комнатах в память (один раз, до обработки апдейтов)"""
+        async for rows in self._stream("stream_room_users", batch_size=batch_size):
+            self.membership.load((row["user_id"], row["room_id"]) for row in rows)
+        self.membership.loaded = True
+        logger.info(f"✅ Участники комнат загружены: {self.membership.stats}")
 
     async def get_room_participants(self, room_id: int) -> List[Dict]:
         """Получение участников комнаты"""
-        query = """
-        SELECT u.*, ru.joined_at 
-        FROM room_users ru 
-        INNER JOIN users u ON ru.user_id = u.user_id 
-        WHERE ru.room_id = $1 
-        ORDER BY ru.joined_at ASC
-        """
-        rows = await self.fetch(query, room_id)
+        rows = await self._fetch("get_room_participants", room_id)
         return [dict(row) for row in rows]
 
+    async def get_room_member_ids(self, room_id: int) -> FrozenSet[int]:
+        """ID участников комнаты"""
+        if self.membership.loaded:
+            return self.membership.members(room_id)
+        rows = await self._fetch("get_room_member_ids", room_id)
+        return frozenset(row["user_id"] for row in rows)
+
     async def get_room_participants_count(self, room_id: int) -> int:
         """Получение количества участников комнаты"""
-        query = "SELECT COUNT(*) FROM room_users WHERE room_id = $1"
-        return await self.fetchval(query, room_id)
+        if self.membership.loaded:
+            return self.membership.room_count(room_id)
+        # Для несуществующей комнаты запрос не вернет строк - как и индекс, отвечаем 0
+        return await self._fetchval("get_room_participants_count", room_id) or 0
+
+    async def is_user_in_room(self, user_id: int, room_id: int) -> bool:
+        """Проверка, находится ли пользователь в комнате"""
+        if self.membership.loaded:
+            return self.membership.contains(user_id, room_id)
+        result = await self._fetchval("is_user_in_room", user_id, room_id)
+        return result is not None
+
+    async def update_room_telegram_id(self, room_id: int, telegram_chat_id: int) -> None:
+        """Сохранение ID Telegram чата комнаты"""
+        await self._execute("update_room_telegram_id", telegram_chat_id, room_id)
 
     # ===== МЕТОДЫ ДЛЯ РАБОТЫ С СООБЩЕНИЯМИ =====
 
     async def create_message(self, room_id: int, user_id: int, telegram_message_id: int,
                              message_text: str, user_color_hex: str, user_nickname: str) -> int:
         """Создание нового сообщения"""
-        query = """
-        INSERT INTO messages (room_id, user_id, telegram_message_id, message_text, 
-                            user_color_hex, user_nickname, created_at)
-        VALUES ($1, $2, $3, $4, $5, $6, NOW())
-        RETURNING message_id
-        """
-        message_id = await self.fetchval(
-            query, room_id, user_id, telegram_message_id,
+        message_id = await self._fetchval(
+            "create_message", room_id, user_id, telegram_message_id,
             message_text, user_color_hex, user_nickname
         )
         return message_id
 
-    async def get_room_messages(self, room_id: int, limit: int = 50) -> List[Dict]:
-        """Получение сообщений комнаты"""
-        query = """
-        SELECT m.* 
-        FROM messages m 
-        WHERE m.room_id = $1 
-        ORDER BY m.created_at DESC 
-        LIMIT $2
+    async def allocate_message_ids(self, count: int) -> List[int]:
+        """Резервирует count ID сообщений из последовательности"""
+        rows = await self._fetch("allocate_message_ids", count)
+        return [row[0] for row in rows]
+
+    async def insert_messages(self, records: List[tuple]) -> None:
+        """
+        Пакетная запись сообщений через COPY.
+        Записи - кортежи в порядке MESSAGE_COLUMNS с заранее выделенными message_id.
+        """
+        async with self.acquire() as conn:
+            started = time.perf_counter()
+            failed = True
+            try:
+                await conn.copy_records_to_table("messages", records=records, columns=MESSAGE_COLUMNS)
+                failed = False
+            finally:
+                self.query_stats.record("insert_messages", started, failed)
+
+    async def get_room_messages(self, room_id: int, limit: int = 50,
+                                before: Optional[MessageCursor] = None,
+                                after: Optional[MessageCursor] = None) -> List[Dict]:
+        """
+        Страница истории комнаты, от новых сообщений к старым.
+
+        Args:
+            room_id: ID комнаты
+            limit: Размер страницы
+            before: Сообщения старше курсора (следующая страница назад)
+            after: Сообщения новее курсора (страница вперед)
+
+        Без курсора возвращаются последние limit сообщений. Курсор для
+        соседней страницы - MessageCursor.of(крайнее сообщение страницы).
         """
-        rows = await self.fetch(query, room_id, limit)
+        if before is not None:
+            rows = await self._fetch("get_room_messages_before", room_id, *before, limit)
+        elif after is not None:
+            # Ближайшие к курсору сообщения идут первыми - разворачиваем
+            rows = await self._fetch("get_room_messages_after", room_id, *after, limit)
+            rows.reverse()
+        else:
+            rows = await self._fetch("get_room_messages", room_id, limit)
         return [dict(row) for row in rows]
 
+    async def iter_room_messages(self, room_id: int, batch_size: int = 500) -> AsyncIterator[List[Dict]]:
+        """
+        Вся история комнаты от старых сообщений к новым, пачками.
+
+        Читается через серверный курсор: в памяти только текущая пачка.
+        Пока обход не закончен, он держит соединение пула и транзакцию,
+        поэтому пачки стоит обрабатывать без долгих пауз.
+        """
+        async for rows in self._stream("stream_room_messages", room_id, batch_size=batch_size):
+            yield [dict(row) for row in rows]
+
+    async def _stream(self, name: str, *args, batch_size: int = 500) -> AsyncIterator[List[asyncpg.Record]]:
+        """Результат запроса реестра пачками через серверный курсор"""
+        async with self.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(QUERIES[name].sql, *args)
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        return
+                    yield rows
+
     async def get_message(self, message_id: int) -> Optional[Dict]:
         """Получение сообщения по ID"""
-        query = "SELECT * FROM messages WHERE message_id = $1"
-        row = await self.fetchrow(query, message_id)
+        row = await self._fetchrow("get_message", message_id)
         return dict(row) if row else None
 
     async def delete_message(self, message_id: int) -> None:
         """Удаление сообщения"""
-        query = "DELETE FROM messages WHERE message_id = $1"
-        await self.execute(query, message_id)
+        await self._execute("delete_message", message_id)
+
+    # ===== МЕТОДЫ ДЛЯ РАБОТЫ С АВАТАРКАМИ =====
+
+    async def get_avatar_file_id(self, file_name: str) -> Optional[str]:
+        """Получение Telegram file_id загруженной аватарки"""
+        return await self._fetchval("get_avatar_file_id", file_name)
+
+    async def save_avatar_file_id(self, file_name: str, file_id: str) -> None:
+        """Сохранение Telegram file_id загруженной аватарки"""
+        await self._execute("save_avatar_file_id", file_name, file_id)
+
+    # ===== МЕТОДЫ ДЛЯ СОСТОЯНИЙ FSM =====
+
+    async def get_fsm_state(self, key: str, ttl: float) -> Optional[Dict]:
+        """Состояние и данные (JSON-строка) диалога, если они не старше ttl секунд"""
+        row = await self._fetchrow("get_fsm_state", key, ttl)
+        return dict(row) if row else None
+
+    async def save_fsm_states(self, records: List[Tuple[str, Optional[str], str]]) -> None:
+        """Пакетное сохранение состояний: (ключ, состояние, данные в JSON)"""
+        keys, states, data = zip(*records)
+        await self._execute("save_fsm_states", list(keys), list(states), list(data))
+
+    async def delete_fsm_states(self, keys: List[str]) -> None:
+        """Удаление состояний завершенных диалогов"""
+        await self._execute("delete_fsm_states", keys)
+
+    async def expire_fsm_states(self, ttl: float) -> None:
+        """Удаление состояний, которые не менялись дольше ttl секунд"""
+        await self._execute("expire_fsm_states", ttl)
 
     # ===== СЛУЖЕБНЫЕ МЕТОДЫ =====
 
-    async def initialize_tables(self):
-        """Инициализация таблиц (если не существуют)"""
+    async def initialize_tables(self, db_url: str):
+        """Инициализация таблиц: применение недостающих миграций"""
         try:
-            # Проверяем существование таблиц и создаем при необходимости
-            # Основная инициализация должна быть через schema.sql
-            logger.info("✅ Таблицы БД проверены")
+            conn = await asyncpg.connect(db_url)
+            try:
+                await migrate(conn)
+            finally:
+                await conn.close()
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации таблиц: {e}")
-            raise
\ No newline at end of file
+            raise
+
+
+# Общий экземпляр для бота и сервисов
+db = Database()
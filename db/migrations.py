@@ -0,0 +1,266 @@
+# db/migrations.py
+"""
+Версионированные миграции схемы БД.
+
+Запуск (обычно не нужен - бот применяет миграции при подключении):
+    python -m db.migrations [--status]
+
+Примененные версии хранятся в schema_migrations. Миграции выполняются
+под advisory lock, поэтому одновременно стартующие экземпляры бота
+не применяют одну миграцию дважды. Миграции с transactional=False
+выполняются вне транзакции - так строятся индексы CONCURRENTLY,
+без блокировки записи в живую таблицу.
+
+Блокировка берется через pg_try_advisory_lock с повтором: ожидание
+внутри pg_advisory_lock держало бы снимок, а CREATE INDEX CONCURRENTLY
+ждет завершения всех снимков - экземпляры заблокировали бы друг друга.
+"""
+import argparse
+import asyncio
+import logging
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock для миграций
+MIGRATIONS_LOCK_ID = 7_100_150_001
+# Пауза между попытками взять блокировку, с
+LOCK_RETRY_INTERVAL = 0.5
+
+
+class Migration(NamedTuple):
+    """Одна версия схемы"""
+    version: int
+    name: str
+    statements: Tuple[str, ...]
+    transactional: bool = True
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(1, "initial_schema", ("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            nickname VARCHAR(32) NOT NULL,
+            color_hex VARCHAR(7) NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """, """
+        CREATE TABLE IF NOT EXISTS rooms (
+            room_id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            created_by BIGINT REFERENCES users(user_id),
+            is_public BOOLEAN DEFAULT true,
+            password VARCHAR(100),
+            max_participants INTEGER DEFAULT 50,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """, """
+        CREATE TABLE IF NOT EXISTS room_users (
+            user_id BIGINT REFERENCES users(user_id),
+            room_id INTEGER REFERENCES rooms(room_id),
+            joined_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (user_id, room_id)
+        )
+    """, """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id SERIAL PRIMARY KEY,
+            room_id INTEGER REFERENCES rooms(room_id),
+            user_id BIGINT REFERENCES users(user_id),
+            telegram_message_id INTEGER,
+            message_text TEXT NOT NULL,
+            user_color_hex VARCHAR(7) NOT NULL,
+            user_nickname VARCHAR(32) NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """, """
+        CREATE TABLE IF NOT EXISTS avatar_files (
+            file_name VARCHAR(64) PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT NOW()
+        )
+    """)),
+
+    Migration(2, "rooms_telegram_chat_id", (
+        "ALTER TABLE rooms ADD COLUMN IF NOT EXISTS telegram_chat_id BIGINT",
+    )),
+
+    # get_room_messages: фильтр по комнате и сортировка по времени
+    # get_room_participants(_count): фильтр room_users по комнате
+    # get_user_by_nickname: поиск по нику
+    Migration(3, "hot_query_indexes", (
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_room_created
+        ON messages (room_id, created_at DESC, message_id DESC)
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_room_users_room_joined
+        ON room_users (room_id, joined_at)
+        """,
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_users_nickname ON users (nickname)",
+    ), transactional=False),
+
+    # Счетчик участников для каталога комнат вместо GROUP BY по room_users
+    Migration(4, "rooms_participants_count", (
+        "ALTER TABLE rooms ADD COLUMN IF NOT EXISTS participants_count INTEGER NOT NULL DEFAULT 0",
+        """
+        UPDATE rooms r SET participants_count = (
+            SELECT COUNT(*) FROM room_users ru WHERE ru.room_id = r.room_id
+        )
+        """,
+    )),
+
+    # Страницы каталога (новые первыми) и топ по участникам
+    Migration(5, "public_rooms_indexes", (
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rooms_public_created
+        ON rooms (created_at DESC, room_id DESC) WHERE is_public
+        """,
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_rooms_public_popular
+        ON rooms (participants_count DESC, room_id DESC) WHERE is_public
+        """,
+    ), transactional=False),
+
+    # Состояния FSM диалогов (services/fsm_storage.py)
+    Migration(6, "fsm_states", (
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)",
+    )),
+)
+
+INDEX_NAME_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.I)
+
+
+async def get_applied_versions(conn: asyncpg.Connection) -> List[int]:
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+    rows = await conn.fetch("SELECT version FROM schema_migrations ORDER BY version")
+    return [row["version"] for row in rows]
+
+
+async def migrate(conn: asyncpg.Connection, target: Optional[int] = None) -> List[int]:
+    """
+    Применяет недостающие миграции по порядку.
+
+    Args:
+        conn: Отдельное соединение (не из пула и не в транзакции)
+        target: Последняя применяемая версия (по умолчанию - все)
+
+    Returns:
+        List[int]: Примененные сейчас версии
+    """
+    await _acquire_lock(conn)
+    try:
+        applied = set(await get_applied_versions(conn))
+        done = []
+
+        for migration in MIGRATIONS:
+            if migration.version in applied or (target is not None and migration.version > target):
+                continue
+
+            logger.info(f"⏳ Миграция {migration.version}: {migration.name}")
+            if migration.transactional:
+                async with conn.transaction():
+                    for statement in migration.statements:
+                        await conn.execute(statement)
+                    await _record(conn, migration)
+            else:
+                for statement in migration.statements:
+                    await _drop_invalid_index(conn, statement)
+                    await conn.execute(statement)
+                await _record(conn, migration)
+
+            done.append(migration.version)
+
+        if done:
+            logger.info(f"✅ Применены миграции: {', '.join(map(str, done))}")
+        else:
+            logger.info("✅ Схема БД актуальна")
+        return done
+
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+
+
+async def _acquire_lock(conn: asyncpg.Connection):
+    """Ждет блокировку миграций, не оставляя открытого запроса между попытками"""
+    waiting = False
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATIONS_LOCK_ID):
+        if not waiting:
+            logger.info("⏳ Миграции применяет другой экземпляр, ждем...")
+            waiting = True
+        await asyncio.sleep(LOCK_RETRY_INTERVAL)
+
+
+async def _record(conn: asyncpg.Connection, migration: Migration):
+    await conn.execute(
+        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+        migration.version, migration.name
+    )
+
+
+async def _drop_invalid_index(conn: asyncpg.Connection, statement: str):
+    """
+    Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс,
+    и IF NOT EXISTS его бы пропустил - такой индекс строится заново.
+    """
+    match = INDEX_NAME_RE.search(statement)
+    if not match:
+        return
+
+    is_valid = await conn.fetchval(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)",
+        match.group(1)
+    )
+    if is_valid is False:
+        logger.warning(f"⚠️ Индекс {match.group(1)} невалиден после прерванной сборки, пересоздаем")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+async def show_status(conn: asyncpg.Connection):
+    applied = set(await get_applied_versions(conn))
+    for migration in MIGRATIONS:
+        mark = "✅" if migration.version in applied else "⏳"
+        print(f"{mark} {migration.version:>3} {migration.name}")
+
+
+async def run(status: bool = False, target: Optional[int] = None):
+    from config import Config
+
+    conn = await asyncpg.connect(Config().DB_URL)
+    try:
+        if status:
+            await show_status(conn)
+        else:
+            await migrate(conn, target)
+    finally:
+        await conn.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m db.migrations", description="Миграции схемы БД NOIS")
+    parser.add_argument("--status", action="store_true", help="Показать примененные миграции")
+    parser.add_argument("--target", type=int, help="Применить миграции до этой версии включительно")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args.status, args.target))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# db/queries.py
+"""
+Реестр SQL-запросов бота.
+
+Каждый запрос Database называется по имени из QUERIES. Запросы с
+prepare=True готовятся на каждом соединении пула при его открытии
+и дальше выполняются без разбора и планирования на каждый вызов.
+Для всех запросов считаются количество вызовов и время выполнения.
+"""
+import logging
+import time
+from typing import Dict, List, NamedTuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+class Query(NamedTuple):
+    """Текст запроса и нужно ли готовить его на каждом соединении"""
+    sql: str
+    prepare: bool = False
+
+
+QUERIES: Dict[str, Query] = {
+    # ===== ПОЛЬЗОВАТЕЛИ =====
+
+    # Возвращает прежний ник (NULL для нового пользователя) - для TakenNicknames
+    "create_user": Query("""
+        WITH old AS (SELECT nickname FROM users WHERE user_id = $1)
+        INSERT INTO users (user_id, nickname, color_hex, created_at)
+        VALUES ($1, $2, $3, NOW())
+        ON CONFLICT (user_id) DO UPDATE SET
+            nickname = EXCLUDED.nickname,
+            color_hex = EXCLUDED.color_hex
+        RETURNING (SELECT nickname FROM old)
+    """, prepare=True),
+    "get_user": Query("SELECT * FROM users WHERE user_id = $1", prepare=True),
+    "get_user_by_nickname": Query("SELECT * FROM users WHERE nickname = $1", prepare=True),
+    "iter_users": Query("""
+        SELECT * FROM users
+        WHERE user_id > $1
+        ORDER BY user_id
+        LIMIT $2
+    """),
+    "get_users_count": Query("SELECT COUNT(*) FROM users"),
+    "update_user_nickname": Query("""
+        UPDATE users u SET nickname = $1
+        FROM (SELECT user_id, nickname FROM users WHERE user_id = $2 FOR UPDATE) old
+        WHERE u.user_id = old.user_id
+        RETURNING old.nickname
+    """),
+    "notify_user_change": Query("SELECT pg_notify($1, $2)"),
+    "update_user_color": Query("UPDATE users SET color_hex = $1 WHERE user_id = $2"),
+
+    # ===== КОМНАТЫ =====
+
+    "create_room": Query("""
+        INSERT INTO rooms (name, created_by, is_public, password, max_participants, created_at)
+        VALUES ($1, $2, $3, $4, $5, NOW())
+        RETURNING room_id
+    """),
+    "get_room": Query("""
+        SELECT r.*, u.nickname as creator_nickname
+        FROM rooms r
+        LEFT JOIN users u ON r.created_by = u.user_id
+        WHERE r.room_id = $1
+    """, prepare=True),
+    # Каталог публичных комнат: participants_count ведется в rooms
+    # при входе и выходе, страницы идут по частичным индексам миграции 5
+    "get_public_rooms": Query("""
+        SELECT r.*, u.nickname as creator_nickname
+        FROM rooms r
+        LEFT JOIN users u ON r.created_by = u.user_id
+        WHERE r.is_public = true
+        ORDER BY r.created_at DESC, r.room_id DESC
+        LIMIT $1
+    """, prepare=True),
+    "get_public_rooms_before": Query("""
+        SELECT r.*, u.nickname as creator_nickname
+        FROM rooms r
+        LEFT JOIN users u ON r.created_by = u.user_id
+        WHERE r.is_public = true AND (r.created_at, r.room_id) < ($1, $2)
+        ORDER BY r.created_at DESC, r.room_id DESC
+        LIMIT $3
+    """, prepare=True),
+    "get_top_public_rooms": Query("""
+        SELECT r.*, u.nickname as creator_nickname
+        FROM rooms r
+        LEFT JOIN users u ON r.created_by = u.user_id
+        WHERE r.is_public = true
+        ORDER BY r.participants_count DESC, r.room_id DESC
+        LIMIT $1
+    """, prepare=True),
+    "get_public_rooms_count": Query("SELECT COUNT(*) FROM rooms WHERE is_public = true"),
+    # "Мои комнаты": комнаты по первичному ключу room_users (user_id, room_id),
+    # счетчик участников из rooms, последнее сообщение - одна проба индекса
+    # (room_id, created_at DESC, message_id DESC) на комнату
+    "get_user_rooms": Query("""
+        SELECT r.*, u.nickname as creator_nickname, ru.joined_at,
+               lm.message_id as last_message_id,
+               lm.message_text as last_message_text,
+               lm.user_nickname as last_message_nickname,
+               lm.created_at as last_message_at
+        FROM room_users ru
+        INNER JOIN rooms r ON r.room_id = ru.room_id
+        LEFT JOIN users u ON r.created_by = u.user_id
+        LEFT JOIN LATERAL (
+            SELECT m.message_id, left(m.message_text, $2) as message_text,
+                   m.user_nickname, m.created_at
+            FROM messages m
+            WHERE m.room_id = r.room_id
+            ORDER BY m.created_at DESC, m.message_id DESC
+            LIMIT 1
+        ) lm ON true
+        WHERE ru.user_id = $1
+        ORDER BY ru.joined_at DESC
+        LIMIT $3
+    """, prepare=True),
+    "get_user_rooms_count": Query("SELECT COUNT(*) FROM room_users WHERE user_id = $1"),
+    # Вход и выход меняют счетчик участников тем же выражением - атомарно
+    "add_user_to_room": Query("""
+        WITH added AS (
+            INSERT INTO room_users (user_id, room_id, joined_at)
+            VALUES ($1, $2, NOW())
+            ON CONFLICT (user_id, room_id) DO NOTHING
+            RETURNING room_id
+        )
+        UPDATE rooms SET participants_count = participants_count + 1
+        WHERE room_id IN (SELECT room_id FROM added)
+    """, prepare=True),
+    "stream_room_users": Query("SELECT user_id, room_id FROM room_users"),
+    "remove_user_from_room": Query("""
+        WITH removed AS (
+            DELETE FROM room_users WHERE user_id = $1 AND room_id = $2
+            RETURNING room_id
+        )
+        UPDATE rooms SET participants_count = participants_count - 1
+        WHERE room_id IN (SELECT room_id FROM removed)
+    """),
+    "get_room_participants": Query("""
+        SELECT u.*, ru.joined_at
+        FROM room_users ru
+        INNER JOIN users u ON ru.user_id = u.user_id
+        WHERE ru.room_id = $1
+        ORDER BY ru.joined_at ASC
+    """),
+    "get_room_member_ids": Query("SELECT user_id FROM room_users WHERE room_id = $1", prepare=True),
+    "get_room_participants_count": Query("SELECT participants_count FROM rooms WHERE room_id = $1", prepare=True),
+    "is_user_in_room": Query("SELECT 1 FROM room_users WHERE user_id = $1 AND room_id = $2", prepare=True),
+    "update_room_telegram_id": Query("UPDATE rooms SET telegram_chat_id = $1 WHERE room_id = $2"),
+
+    # ===== СООБЩЕНИЯ =====
+
+    "create_message": Query("""
+        INSERT INTO messages (room_id, user_id, telegram_message_id, message_text,
+                            user_color_hex, user_nickname, created_at)
+        VALUES ($1, $2, $3, $4, $5, $6, NOW())
+        RETURNING message_id
+    """, prepare=True),
+    # История читается по индексу (room_id, created_at DESC, message_id DESC):
+    # курсор - пара (created_at, message_id) последнего сообщения страницы
+    "get_room_messages": Query("""
+        SELECT * FROM messages
+        WHERE room_id = $1
+        ORDER BY created_at DESC, message_id DESC
+        LIMIT $2
+    """, prepare=True),
+    "get_room_messages_before": Query("""
+        SELECT * FROM messages
+        WHERE room_id = $1 AND (created_at, message_id) < ($2, $3)
+        ORDER BY created_at DESC, message_id DESC
+        LIMIT $4
+    """, prepare=True),
+    "get_room_messages_after": Query("""
+        SELECT * FROM messages
+        WHERE room_id = $1 AND (created_at, message_id) > ($2, $3)
+        ORDER BY created_at ASC, message_id ASC
+        LIMIT $4
+    """, prepare=True),
+    "stream_room_messages": Query("""
+        SELECT * FROM messages
+        WHERE room_id = $1
+        ORDER BY created_at ASC, message_id ASC
+    """),
+    "allocate_message_ids": Query("""
+        SELECT nextval(pg_get_serial_sequence('messages', 'message_id'))
+        FROM generate_series(1, $1)
+    """, prepare=True),
+    "get_message": Query("SELECT * FROM messages WHERE message_id = $1"),
+    "delete_message": Query("DELETE FROM messages WHERE message_id = $1"),
+
+    # ===== АВАТАРКИ =====
+
+    "get_avatar_file_id": Query("SELECT file_id FROM avatar_files WHERE file_name = $1", prepare=True),
+    "save_avatar_file_id": Query("""
+        INSERT INTO avatar_files (file_name, file_id, created_at)
+        VALUES ($1, $2, NOW())
+        ON CONFLICT (file_name) DO UPDATE SET file_id = EXCLUDED.file_id
+    """),
+
+    # ===== СОСТОЯНИЯ FSM =====
+
+    "get_fsm_state": Query("""
+        SELECT state, data FROM fsm_states
+        WHERE key = $1 AND updated_at > NOW() - make_interval(secs => $2)
+    """, prepare=True),
+    "save_fsm_states": Query("""
+        INSERT INTO fsm_states (key, state, data, updated_at)
+        SELECT key, state, data::jsonb, NOW()
+        FROM unnest($1::text[], $2::text[], $3::text[]) AS t(key, state, data)
+        ON CONFLICT (key) DO UPDATE SET
+            state = EXCLUDED.state,
+            data = EXCLUDED.data,
+            updated_at = EXCLUDED.updated_at
+    """, prepare=True),
+    "delete_fsm_states": Query("DELETE FROM fsm_states WHERE key = ANY($1::text[])"),
+    "expire_fsm_states": Query("DELETE FROM fsm_states WHERE updated_at < NOW() - make_interval(secs => $1)"),
+}
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Соединение с подготовленными запросами реестра: prepared[имя]"""
+
+    __slots__ = ("prepared",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+
+async def prepare_queries(conn: PreparedConnection):
+    """Хук пула: готовит запросы с prepare=True на новом соединении"""
+    for name, query in QUERIES.items():
+        if query.prepare:
+            conn.prepared[name] = await conn.prepare(query.sql)
+
+
+class QueryStats:
+    """Количество вызовов и время выполнения запросов по именам"""
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.total_time: Dict[str, float] = {}
+        self.max_time: Dict[str, float] = {}
+
+    def record(self, name: str, started: float, failed: bool = False):
+        elapsed = time.perf_counter() - started
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.total_time[name] = self.total_time.get(name, 0.0) + elapsed
+        self.max_time[name] = max(self.max_time.get(name, 0.0), elapsed)
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self) -> List[Dict]:
+        """Статистика по запросам, самые затратные по суммарному времени первыми"""
+        return [
+            {
+                "name": name,
+                "calls": calls,
+                "errors": self.errors.get(name, 0),
+                "prepared": name in QUERIES and QUERIES[name].prepare,
+                "total_ms": round(self.total_time[name] * 1000, 3),
+                "avg_ms": round(self.total_time[name] / calls * 1000, 3),
+                "max_ms": round(self.max_time[name] * 1000, 3),
+            }
+            for name, calls in sorted(self.calls.items(), key=lambda item: -self.total_time[item[0]])
+        ]
@@ -0,0 +1,121 @@
+# services/avatar_delivery.py
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message
+
+from services.avatar_renderer import AvatarRenderer
+from services.send_queue import SendQueue
+
+logger = logging.getLogger(__name__)
+
+
+class AvatarDelivery:
+    """
+    Отправляет аватарки в Telegram с минимумом загрузок.
+
+    Файл отправляется один раз из памяти через BufferedInputFile, дальше
+    используется file_id, который вернул Telegram. Связь файл -> file_id
+    хранится в БД и переживает перезапуск. Файлы в хранилище названы по
+    хэшу содержимого, поэтому одна и та же картинка у разных пользователей
+    загружается только один раз, а перегенерированная - заново.
+
+    Отправки идут через SendQueue, как и остальные сообщения бота, чтобы
+    соблюдать лимиты Telegram и порядок сообщений в чате. Оба кеша в памяти
+    ограничены: содержимое файлов - по объему, file_id - по числу записей.
+    """
+
+    def __init__(self, bot: Bot, db, renderer: AvatarRenderer, send_queue: SendQueue,
+                 max_cache_bytes: int = 32 * 1024 * 1024, max_file_ids: int = 10000):
+        self.bot = bot
+        self.db = db
+        self.renderer = renderer
+        self.send_queue = send_queue
+        self.max_cache_bytes = max_cache_bytes
+        self.max_file_ids = max_file_ids
+
+        self._bytes: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+
+    async def send_avatar(self, chat_id: int, nickname: str, size: int = 512,
+                          caption: Optional[str] = None) -> Message:
+        """Отправляет текущую аватарку пользователя"""
+        filepath, _ = await self.renderer.get_avatar(nickname, size)
+        return await self.send_file(chat_id, filepath, caption)
+
+    async def send_random_avatar(self, chat_id: int, nickname: str, size: int = 512,
+                                 caption: Optional[str] = None) -> Message:
+        """Рисует и отправляет аватарку со случайными цветами"""
+        filepath, _ = await self.renderer.random_avatar(nickname, size)
+        return await self.send_file(chat_id, filepath, caption)
+
+    async def send_file(self, chat_id: int, filepath: str, caption: Optional[str] = None) -> Message:
+        """Отправляет файл аватарки по file_id, а если его нет - загружает из памяти"""
+        file_name = os.path.basename(filepath)
+
+        file_id = await self._get_file_id(file_name)
+        if file_id:
+            try:
+                return await self.send_queue.send(
+                    chat_id, lambda: self.bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
+                )
+            except TelegramBadRequest as e:
+                logger.warning(f"file_id аватарки {file_name} больше не действителен: {e}")
+                self._file_ids.pop(file_name, None)
+
+        data = await self._get_bytes(filepath)
+        message = await self.send_queue.send(chat_id, lambda: self.bot.send_photo(
+            chat_id=chat_id,
+            photo=BufferedInputFile(data, filename=file_name),
+            caption=caption
+        ))
+
+        file_id = message.photo[-1].file_id
+        self._remember_file_id(file_name, file_id)
+        await self.db.save_avatar_file_id(file_name, file_id)
+        return message
+
+    async def _get_file_id(self, file_name: str) -> Optional[str]:
+        file_id = self._file_ids.get(file_name)
+        if file_id is not None:
+            self._file_ids.move_to_end(file_name)
+            return file_id
+
+        file_id = await self.db.get_avatar_file_id(file_name)
+        if file_id:
+            self._remember_file_id(file_name, file_id)
+        return file_id
+
+    def _remember_file_id(self, file_name: str, file_id: str):
+        """file_id в LRU-кеше, ограниченном по числу записей (вытесненные остаются в БД)"""
+        self._file_ids[file_name] = file_id
+        self._file_ids.move_to_end(file_name)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+
+    async def _get_bytes(self, filepath: str) -> bytes:
+        """Содержимое файла из LRU-кеша, ограниченного по суммарному объему"""
+        data = self._bytes.get(filepath)
+        if data is not None:
+            self._bytes.move_to_end(filepath)
+            return data
+
+        data = await asyncio.to_thread(_read_file, filepath)
+        if len(data) <= self.max_cache_bytes:
+            self._bytes[filepath] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.max_cache_bytes:
+                _, evicted = self._bytes.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+        return data
+
+
+def _read_file(filepath: str) -> bytes:
+    with open(filepath, "rb") as file:
+        return file.read()
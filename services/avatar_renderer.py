@@ -0,0 +1,106 @@
+# services/avatar_renderer.py
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from utils.avatars import (
+    avatar_store, generate_beautiful_color_pair, get_render_sizes, render_beautiful_avatar, render_random_avatar
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AvatarRendererBusy(Exception):
+    """Очередь рендера переполнена - запрос стоит повторить позже"""
+
+
+class AvatarRenderer:
+    """
+    Рендерит аватарки в пуле процессов, не блокируя event loop.
+    Процессы только рисуют картинку, индекс хранилища ведется здесь.
+
+    Одинаковые запросы (никнейм + размер), пришедшие одновременно,
+    объединяются в один рендер; каждый рендер сразу сохраняет все размеры
+    и форматы аватарки. Число ожидающих задач ограничено:
+    при переполнении очереди выбрасывается AvatarRendererBusy.
+
+    По умолчанию пул занимает все ядра, кроме одного; если рядом работают
+    еще shards воркеров со своими пулами, ядра делятся между ними поровну.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: int = 64, shards: int = 1):
+        self.max_workers = max_workers or max(1, ((os.cpu_count() or 2) - 1) // max(1, shards))
+        self.max_pending = max_pending
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(self.max_workers)
+        self._in_flight: Dict[Tuple[str, str, int], asyncio.Future] = {}
+
+    @property
+    def pending(self) -> int:
+        """Количество уникальных задач в работе и в очереди"""
+        return len(self._in_flight)
+
+    async def get_avatar(self, nickname: str, size: int = 512, fmt: str = "png") -> Tuple[str, str]:
+        """Аватарка пользователя (из хранилища или новая)"""
+        filepath = avatar_store.get(nickname, size, fmt=fmt)
+        if filepath:
+            color1, _ = generate_beautiful_color_pair(nickname)
+            return filepath, color1
+        return await self._submit("default", render_beautiful_avatar, nickname, size, fmt)
+
+    async def regenerate_avatar(self, nickname: str, size: int = 512, fmt: str = "png") -> Tuple[str, str]:
+        """Принудительное пересоздание аватарки"""
+        return await self._submit("default", render_beautiful_avatar, nickname, size, fmt)
+
+    async def random_avatar(self, nickname: str, size: int = 512, fmt: str = "png") -> Tuple[str, str]:
+        """Аватарка со случайными цветами"""
+        return await self._submit("random", render_random_avatar, nickname, size, fmt)
+
+    async def close(self):
+        """Остановка пула процессов"""
+        if self._executor:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+            logger.info("✅ Пул рендера аватарок остановлен")
+
+    async def _submit(self, variant: str, render: Callable, nickname: str, size: int,
+                      fmt: str) -> Tuple[str, str]:
+        key = (variant, nickname, size)
+
+        future = self._in_flight.get(key)
+        if future is None:
+            if len(self._in_flight) >= self.max_pending:
+                raise AvatarRendererBusy(f"В очереди рендера уже {len(self._in_flight)} задач")
+
+            future = asyncio.ensure_future(self._run(variant, render, nickname, size))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._on_done(key, done))
+
+        # shield: отмена одного ожидающего не должна отменять общий рендер
+        paths, color1 = await asyncio.shield(future)
+        return paths[(size, fmt)], color1
+
+    async def _run(self, variant: str, render: Callable, nickname: str,
+                   size: int) -> Tuple[Dict[Tuple[int, str], str], str]:
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            images, color1 = await loop.run_in_executor(
+                self._get_executor(), render, nickname, get_render_sizes(size)
+            )
+
+        paths = await asyncio.to_thread(avatar_store.put_set, nickname, images, variant)
+        return paths, color1
+
+    def _on_done(self, key: Tuple[str, str, int], future: asyncio.Future):
+        self._in_flight.pop(key, None)
+        if not future.cancelled() and future.exception():
+            logger.error(f"Ошибка рендера аватарки {key}: {future.exception()}")
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            logger.info(f"✅ Пул рендера аватарок запущен ({self.max_workers} процессов)")
+        return self._executor
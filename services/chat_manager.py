@@ -1,17 +1,24 @@
 # services/chat_manager.py
+import asyncio
+import logging
+
 from aiogram import Bot
 from aiogram.types import ChatPermissions
-from db.database import db
-import logging
+from db.database import Database
+from services.room_broadcast import DeliveryReport, RoomBroadcaster
+from services.send_queue import SendQueue
 
 logger = logging.getLogger(__name__)
 
 
 class ChatManager:
-    """Управляет Telegram чатами для комнат"""
+    """Управляет Telegram чатами для комнат. Все отправки идут через SendQueue"""
 
-    def __init__(self, bot: Bot):
+    def __init__(self, bot: Bot, db: Database, send_queue: SendQueue):
         self.bot = bot
+        self.db = db
+        self.send_queue = send_queue
+        self.broadcaster = RoomBroadcaster(db, send_queue)
 
     async def create_room_chat(self, room_id: int, room_name: str) -> int:
         """
@@ -26,7 +33,7 @@ class ChatManager:
             fake_chat_id = room_id + 1000000000  # Временное решение
 
             # Сохраняем ID чата в базе
-            await db.update_room_telegram_id(room_id, fake_chat_id)
+            await self.db.update_room_telegram_id(room_id, fake_chat_id)
 
             logger.info(f"Создан виртуальный чат для комнаты {room_id}: {fake_chat_id}")
             return fake_chat_id
@@ -41,9 +48,9 @@ class ChatManager:
             logger.info(f"Запрос на добавление пользователя {user_id} в чат {chat_id}")
 
             # Временная заглушка
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=f"🎉 Виртуальный доступ к чату комнаты!\n\nID чата: {chat_id}"
+            await self.send_queue.send_message(
+                user_id,
+                f"🎉 Виртуальный доступ к чату комнаты!\n\nID чата: {chat_id}"
             )
 
             return True
@@ -52,38 +59,14 @@ class ChatManager:
             logger.error(f"Ошибка добавления пользователя {user_id} в чат {chat_id}: {e}")
             return False
 
-    async def send_message_to_room(self, chat_id: int, user_nickname: str,
-                                   user_color: str, message_text: str) -> int:
+    def send_message_to_room(self, room_id: int, sender_id: int, user_nickname: str,
+                             user_color: str, message_text: str) -> "asyncio.Task[DeliveryReport]":
         """
-        Отправляет сообщение в чат комнаты с оформлением
-        Returns: ID отправленного сообщения
+        Рассылает сообщение участникам комнаты, не дожидаясь доставки.
+        Returns: Задача рассылки, ее результат - DeliveryReport
         """
-        try:
-            # Временная реализация - отправляем сообщение обратно пользователю
-            formatted_message = f"💬 <b>Сообщение в комнату (ID: {chat_id})</b>\n\n"
-            formatted_message += f"<b><font color='{user_color}'>{user_nickname}</font></b>: {message_text}"
-
-            message = await self.bot.send_message(
-                chat_id=user_id,  # Временно отправляем пользователю
-                text=formatted_message,
-                parse_mode='HTML'
-            )
-
-            logger.info(f"Отправлено виртуальное сообщение от {user_nickname} в чат {chat_id}")
-            return message.message_id
-
-        except Exception as e:
-            logger.error(f"Ошибка отправки сообщения в чат {chat_id}: {e}")
-            # Fallback: отправляем пользователю
-            try:
-                message = await self.bot.send_message(
-                    chat_id=user_id,
-                    text=f"💬 <b>Ваше сообщение:</b> {message_text}",
-                    parse_mode='HTML'
-                )
-                return message.message_id
-            except:
-                raise
+        logger.info(f"Рассылка сообщения от {user_nickname} в комнату {room_id}")
+        return self.broadcaster.broadcast(room_id, sender_id, user_nickname, user_color, message_text)
 
     async def pin_webapp_message(self, chat_id: int, webapp_text: str) -> int:
         """Закрепляет WebApp сообщение в чате (заглушка)"""
@@ -0,0 +1,147 @@
+# services/fsm_storage.py
+import asyncio
+import json
+import logging
+from typing import Any, Dict, NamedTuple, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from db.database import Database
+from utils.cache import AsyncCache
+
+logger = logging.getLogger(__name__)
+
+
+class FSMRecord(NamedTuple):
+    """Состояние диалога и его данные"""
+    state: Optional[str]
+    data: Dict[str, Any]
+
+
+EMPTY_RECORD = FSMRecord(None, {})
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_states через общий пул БД.
+
+    Чтения идут из кеша в памяти, записи копятся и раз в flush_interval
+    секунд уходят в БД одним upsert: set_state и update_data одного
+    обработчика дают одну запись. Пустые состояния (диалог завершен)
+    удаляются, а брошенные - старше ttl секунд - не читаются и
+    периодически вычищаются.
+
+    Кеш чтений верен, только если апдейты одного пользователя обрабатывает
+    один процесс (режим с шардингом по user_id). Когда несколько
+    экземпляров принимают апдейты вперемешку (webhook за балансировщиком),
+    кеш нужно выключить: cache_ttl=0 - тогда чтения идут в БД, а из
+    памяти берутся только еще не записанные изменения этого процесса.
+    """
+
+    def __init__(self, db: Database, ttl: float = 24 * 3600, flush_interval: float = 0.2,
+                 cache_ttl: float = 60.0, expire_interval: float = 600.0,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.expire_interval = expire_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+
+        self._cache = AsyncCache(ttl=cache_ttl, max_size=50000) if cache_ttl > 0 else None
+        self._dirty: Dict[str, FSMRecord] = {}
+        # Записи, которые сейчас пишутся в БД: до коммита читать их надо отсюда
+        self._flushing: Dict[str, FSMRecord] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get(key)
+        state = state.state if isinstance(state, State) else state
+        self._put(key, record._replace(state=state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._get(key)
+        self._put(key, record._replace(data=dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._get(key)).data)
+
+    async def flush(self):
+        """Записывает накопленные изменения"""
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, {}
+        self._flushing.update(dirty)
+        upserts = [(key, record.state, json.dumps(record.data, ensure_ascii=False))
+                   for key, record in dirty.items() if record != EMPTY_RECORD]
+        deletes = [key for key, record in dirty.items() if record == EMPTY_RECORD]
+        try:
+            if upserts:
+                await self.db.save_fsm_states(upserts)
+            if deletes:
+                await self.db.delete_fsm_states(deletes)
+        except BaseException:
+            # Вернуть в очередь то, что не успели перезаписать новыми изменениями
+            # (в том числе при отмене посреди записи)
+            for key, record in dirty.items():
+                self._dirty.setdefault(key, record)
+            raise
+        finally:
+            for key, record in dirty.items():
+                if self._flushing.get(key) is record:
+                    del self._flushing[key]
+
+    async def close(self) -> None:
+        if self._flusher:
+            flusher, self._flusher = self._flusher, None
+            flusher.cancel()
+            await asyncio.gather(flusher, return_exceptions=True)
+        await self.flush()
+
+    async def _get(self, key: StorageKey) -> FSMRecord:
+        storage_key = self.key_builder.build(key)
+        record = self._dirty.get(storage_key) or self._flushing.get(storage_key)
+        if record is None:
+            if self._cache is None:
+                record = await self._load(storage_key)
+            else:
+                record = await self._cache.get(storage_key, self._load)
+        return record
+
+    async def _load(self, storage_key: str) -> FSMRecord:
+        row = await self.db.get_fsm_state(storage_key, self.ttl)
+        if not row:
+            return EMPTY_RECORD
+        return FSMRecord(row["state"], json.loads(row["data"]))
+
+    def _put(self, key: StorageKey, record: FSMRecord):
+        storage_key = self.key_builder.build(key)
+        self._dirty[storage_key] = record
+        if self._cache is not None:
+            self._cache.set(storage_key, record)
+
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+        self._wakeup.set()
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        next_expire = loop.time()
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if loop.time() >= next_expire:
+                    await self.db.expire_fsm_states(self.ttl)
+                    next_expire = loop.time() + self.expire_interval
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи состояний FSM: {e}")
+                self._wakeup.set()
+                await asyncio.sleep(1.0)
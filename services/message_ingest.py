@@ -0,0 +1,191 @@
+# services/message_ingest.py
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Порядок полей записи совпадает с db.database.MESSAGE_COLUMNS
+MessageRecord = Tuple[int, int, int, Optional[int], str, str, str]
+
+# Ошибки, после которых пачку имеет смысл повторить целиком
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.DeadlockDetectedError,
+    asyncpg.SerializationError,
+)
+
+
+class MessageIngestClosed(Exception):
+    """Прием сообщений остановлен"""
+
+
+class MessageIngest:
+    """
+    Буферизованная запись сообщений в БД.
+
+    submit сразу возвращает message_id (ID заранее берутся из
+    последовательности блоками), а сами строки копируются в таблицу
+    пачками через COPY, когда набирается max_batch сообщений или
+    проходит flush_interval секунд. Если буфер заполнен (БД не успевает),
+    submit ждет места - так нагрузка упирается в отправителей, а не в
+    память. close дописывает все, что осталось в буфере.
+
+    Пачка повторяется только при сбоях соединения и других временных
+    ошибках. Если БД отвергла данные (нарушен внешний ключ, слишком
+    длинный ник и т.п.), пачка пишется построчно, а строки, которые
+    не удалось записать, попадают в лог и счетчик dropped - одна плохая
+    запись не блокирует остальные.
+
+    created_at строки выставляет БД при записи пачки, поэтому время
+    сообщения отстает не больше чем на flush_interval; внутри пачки
+    порядок задает message_id.
+    """
+
+    def __init__(self, db, max_batch: int = 500, flush_interval: float = 0.5,
+                 max_buffered: int = 5000, id_block_size: int = 100):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+
+        self._queue: "asyncio.Queue[MessageRecord]" = asyncio.Queue(maxsize=max_buffered)
+        self._ids: Deque[int] = deque()
+        self._ids_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self._writing = 0
+        self._closed = False
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    @property
+    def buffered(self) -> int:
+        """Сообщений в буфере, еще не записанных в БД"""
+        return self._queue.qsize()
+
+    def start(self):
+        if self._writer is None:
+            self._closed = False
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def submit(self, room_id: int, user_id: int, telegram_message_id: Optional[int],
+                     message_text: str, user_color_hex: str, user_nickname: str) -> int:
+        """
+        Ставит сообщение в очередь на запись.
+
+        Returns:
+            int: message_id, под которым сообщение будет записано
+        """
+        if self._closed:
+            raise MessageIngestClosed("Прием сообщений остановлен")
+
+        message_id = await self._next_id()
+        await self._queue.put(
+            (message_id, room_id, user_id, telegram_message_id, message_text, user_color_hex, user_nickname)
+        )
+        return message_id
+
+    async def flush(self):
+        """Ждет, пока все поставленные в очередь сообщения будут записаны"""
+        await self._queue.join()
+
+    async def close(self, timeout: float = 10.0) -> int:
+        """
+        Останавливает прием и дописывает буфер в БД (не дольше timeout секунд)
+
+        Returns:
+            int: Сколько сообщений так и не записано
+        """
+        self._closed = True
+        if self._writer is None:
+            return 0
+
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        unwritten = self.buffered + self._writing
+        writer, self._writer = self._writer, None
+        writer.cancel()
+        try:
+            await writer
+        except asyncio.CancelledError:
+            pass
+
+        if unwritten:
+            logger.error(f"❌ Не записано {unwritten} сообщений: БД не ответила за {timeout} с")
+        logger.info(f"✅ Запись сообщений остановлена: {self.written} сообщений в {self.batches} пачках, "
+                    f"отброшено {self.dropped}")
+        return unwritten
+
+    async def _next_id(self) -> int:
+        if not self._ids:
+            async with self._ids_lock:
+                if not self._ids:
+                    self._ids.extend(await self.db.allocate_message_ids(self.id_block_size))
+        return self._ids.popleft()
+
+    async def _write_loop(self):
+        while True:
+            batch = await self._collect_batch()
+            self._writing = len(batch)
+            await self._write(batch)
+            self._writing = 0
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _collect_batch(self) -> List[MessageRecord]:
+        """Первое сообщение ждем сколько угодно, остальные - до конца flush_interval"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: List[MessageRecord]):
+        """Пишет пачку; при отказе БД в данных - построчно"""
+        try:
+            await self._insert(batch)
+        except Exception as e:
+            logger.warning(f"⚠️ БД отвергла пачку из {len(batch)} сообщений, пишем построчно: {e}")
+            for record in batch:
+                try:
+                    await self._insert([record])
+                except Exception as e:
+                    self.dropped += 1
+                    logger.error(f"❌ Сообщение {record[0]} (комната {record[1]}, пользователь {record[2]}) "
+                                 f"не записано: {e}")
+            return
+        self.batches += 1
+
+    async def _insert(self, records: List[MessageRecord]):
+        """Пишет записи, повторяя при временных ошибках: потерять сообщения хуже, чем задержать"""
+        delay = 0.5
+        while True:
+            try:
+                await self.db.insert_messages(records)
+                self.written += len(records)
+                return
+            except TRANSIENT_ERRORS as e:
+                logger.error(f"❌ Ошибка записи {len(records)} сообщений, повтор через {delay} с: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
@@ -0,0 +1,132 @@
+# services/room_broadcast.py
+import asyncio
+import html
+import logging
+from typing import Dict, NamedTuple, Optional, Set
+
+from db.database import Database
+from services.send_queue import Priority, SendQueue
+
+logger = logging.getLogger(__name__)
+
+# Telegram HTML не умеет цвет текста - цвет ника показываем ближайшим кружком
+COLOR_MARKERS = (
+    ((221, 46, 68), "🔴"),
+    ((244, 144, 12), "🟠"),
+    ((253, 203, 88), "🟡"),
+    ((120, 177, 89), "🟢"),
+    ((85, 172, 238), "🔵"),
+    ((170, 142, 214), "🟣"),
+    ((193, 105, 79), "🟤"),
+    ((49, 55, 61), "⚫"),
+    ((230, 231, 232), "⚪"),
+)
+
+
+def color_marker(color_hex: str) -> str:
+    """Эмодзи-кружок, ближайший к цвету #RRGGBB"""
+    color_hex = color_hex.lstrip("#")
+    try:
+        rgb = tuple(int(color_hex[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return "⚪"
+    return min(COLOR_MARKERS, key=lambda marker: sum((a - b) ** 2 for a, b in zip(rgb, marker[0])))[1]
+
+
+def format_room_message(user_nickname: str, user_color: str, message_text: str) -> str:
+    """HTML сообщения комнаты (один раз на сообщение, а не на получателя)"""
+    return (f"{color_marker(user_color)} <b>{html.escape(user_nickname)}</b>: "
+            f"{html.escape(message_text)}")
+
+
+class DeliveryReport(NamedTuple):
+    """Итог рассылки одного сообщения"""
+    room_id: int
+    recipients: int
+    delivered: int
+    failed: Dict[int, str]  # user_id -> ошибка
+
+
+class RoomBroadcaster:
+    """
+    Рассылает сообщение комнаты всем ее участникам, кроме отправителя.
+
+    Получатели берутся из индекса членства в памяти, текст форматируется
+    один раз. Отправки идут через SendQueue с приоритетом рассылки: все
+    получатели ставятся в очередь сразу, а очередь отправляет в каждый
+    чат по одному сообщению в порядке постановки. Рассылки одной комнаты
+    ставятся в очередь строго в порядке вызова broadcast, поэтому
+    получатель видит сообщения комнаты в том порядке, в каком их писали.
+    broadcast не ждет доставки: он возвращает задачу, результат
+    которой - DeliveryReport с ошибками по получателям.
+    """
+
+    def __init__(self, db: Database, send_queue: SendQueue):
+        self.db = db
+        self.send_queue = send_queue
+        self._tasks: Set[asyncio.Task] = set()
+        # Комната -> future, которая завершится, когда последняя рассылка встанет в очередь
+        self._enqueued: Dict[int, asyncio.Future] = {}
+
+    @property
+    def pending(self) -> int:
+        """Рассылок в процессе"""
+        return len(self._tasks)
+
+    def broadcast(self, room_id: int, sender_id: int, user_nickname: str, user_color: str,
+                  message_text: str) -> "asyncio.Task[DeliveryReport]":
+        """Запускает рассылку в фоне и сразу возвращает ее задачу"""
+        text = format_room_message(user_nickname, user_color, message_text)
+        previous = self._enqueued.get(room_id)
+        enqueued = self._enqueued[room_id] = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._deliver(room_id, sender_id, text, previous, enqueued))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        # Отмененная рассылка не должна держать следующие
+        task.add_done_callback(lambda _: self._mark_enqueued(room_id, previous, enqueued))
+        return task
+
+    async def close(self):
+        """Ждет завершения начатых рассылок"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _deliver(self, room_id: int, sender_id: int, text: str,
+                       previous: Optional[asyncio.Future], enqueued: asyncio.Future) -> DeliveryReport:
+        futures: Dict[int, asyncio.Future] = {}
+        failed: Dict[int, str] = {}
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            recipients = await self.db.get_room_member_ids(room_id) - {sender_id}
+            for user_id in recipients:
+                try:
+                    futures[user_id] = await self.send_queue.submit_message(user_id, text, Priority.BROADCAST)
+                except Exception as e:
+                    failed[user_id] = str(e)
+        finally:
+            self._mark_enqueued(room_id, previous, enqueued)
+
+        for user_id, future in futures.items():
+            try:
+                await future
+            except Exception as e:
+                failed[user_id] = str(e)
+
+        report = DeliveryReport(room_id, len(recipients), len(recipients) - len(failed), failed)
+        if failed:
+            logger.warning(f"⚠️ Комната {room_id}: не доставлено {len(failed)} из {len(recipients)}")
+        return report
+
+    def _mark_enqueued(self, room_id: int, previous: Optional[asyncio.Future], enqueued: asyncio.Future):
+        """
+        Рассылка встала в очередь (или прервалась) - следующая рассылка комнаты
+        может начинать, но не раньше, чем встанут в очередь все предыдущие
+        """
+        if previous is not None and not previous.done():
+            previous.add_done_callback(lambda _: self._mark_enqueued(room_id, None, enqueued))
+            return
+        if not enqueued.done():
+            enqueued.set_result(None)
+        if self._enqueued.get(room_id) is enqueued:
+            del self._enqueued[room_id]
@@ -0,0 +1,302 @@
+# services/send_queue.py
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Полосы очереди: меньше - раньше"""
+    REPLY = 0  # Ответы пользователю на его действие
+    BROADCAST = 1  # Рассылка сообщений комнаты
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst подряд"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def try_acquire(self) -> float:
+        """Берет токен и возвращает 0, либо возвращает, сколько секунд ждать"""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds: float):
+        """Пауза после 429 от Telegram"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class _SendJob(NamedTuple):
+    sequence: int
+    chat_id: int
+    call: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    enqueued_at: float
+    attempt: int
+
+
+class SendQueue:
+    """
+    Очередь исходящих запросов к Telegram с учетом лимитов.
+
+    Все отправки идут через фиксированное число воркеров. Перед
+    отправкой берется токен из общего ведра (лимит бота, ~30 сообщений
+    в секунду) и из ведра чата (~1 в секунду в личке, ~20 в минуту в
+    группе). Если чат исчерпал лимит, задача откладывается до его
+    токена, а воркер берет следующую - один активный чат не тормозит
+    остальные. Ответы (Priority.REPLY) идут раньше рассылок
+    (Priority.BROADCAST). На 429 чат ставится на паузу retry_after
+    секунд, и задача повторяется. В один чат одновременно идет не больше
+    одной отправки: следующие ждут ее завершения, поэтому сообщения
+    приходят в порядке постановки. Отложенные задачи одного чата
+    возвращаются в очередь в исходном порядке.
+    """
+
+    MAX_ATTEMPTS = 5
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, bot: Bot, workers: int = 8, global_rate: float = 30.0,
+                 private_rate: float = 1.0, group_rate: float = 20 / 60, max_queued: int = 10000):
+        self.bot = bot
+        self.workers = workers
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+
+        self._queue: "asyncio.PriorityQueue" = asyncio.PriorityQueue(maxsize=max_queued)
+        self._sequence = itertools.count()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._workers: List[asyncio.Task] = []
+        self._parked: Dict[int, Deque[Tuple[Priority, _SendJob]]] = {}
+        self._parked_count = 0
+        self._releases: Dict[int, asyncio.Task] = {}
+        self._sending: Set[int] = set()
+        self._closed = False
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.queued_by_priority: Dict[Priority, int] = {priority: 0 for priority in Priority}
+
+    def start(self):
+        if not self._workers:
+            self._closed = False
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            logger.info(f"✅ Очередь отправки запущена ({self.workers} воркеров)")
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable[Any]],
+                   priority: Priority = Priority.REPLY) -> Any:
+        """Ставит запрос в очередь и ждет его результата"""
+        future = await self.submit(chat_id, call, priority)
+        return await future
+
+    async def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]],
+                     priority: Priority = Priority.REPLY) -> asyncio.Future:
+        """
+        Ставит запрос в очередь и сразу возвращает future с его результатом.
+        Ждет, только если очередь заполнена.
+        """
+        if self._closed:
+            raise RuntimeError("Очередь отправки остановлена")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._put(priority, _SendJob(next(self._sequence), chat_id, call, future, time.monotonic(), 1))
+        return future
+
+    async def send_message(self, chat_id: int, text: str, priority: Priority = Priority.REPLY, **kwargs):
+        """bot.send_message через очередь"""
+        return await (await self.submit_message(chat_id, text, priority, **kwargs))
+
+    async def submit_message(self, chat_id: int, text: str, priority: Priority = Priority.REPLY,
+                             **kwargs) -> asyncio.Future:
+        """bot.send_message через очередь без ожидания отправки (см. submit)"""
+        return await self.submit(
+            chat_id, lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs), priority
+        )
+
+    @property
+    def depth(self) -> int:
+        """Задач в очереди и отложенных до токена чата"""
+        return self._queue.qsize() + self._parked_count
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "queued_reply": self.queued_by_priority[Priority.REPLY],
+            "queued_broadcast": self.queued_by_priority[Priority.BROADCAST],
+            "deferred": self._parked_count,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "avg_latency_ms": round(self.total_latency / self.sent * 1000, 1) if self.sent else 0.0,
+            "max_latency_ms": round(self.max_latency * 1000, 1),
+            "chats": len(self._chats),
+        }
+
+    async def close(self, timeout: float = 10.0):
+        """Останавливает прием и ждет отправки очереди (не дольше timeout)"""
+        self._closed = True
+        if not self._workers:
+            return
+
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Очередь отправки не успела опустеть: осталось {self.depth}")
+
+        tasks = self._workers + list(self._releases.values())
+        self._workers = []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"✅ Очередь отправки остановлена: {self.stats}")
+
+    async def _drain(self):
+        # Отложенные задачи возвращаются в очередь позже - ждем и их
+        while self.depth:
+            await self._queue.join()
+            if self._releases:
+                await asyncio.wait(set(self._releases.values()))
+
+    async def _put(self, priority: Priority, job: _SendJob):
+        self.queued_by_priority[priority] += 1
+        await self._queue.put((priority, job.sequence, job))
+
+    def _defer(self, priority: Priority, job: _SendJob, delay: Optional[float] = None, front: bool = False):
+        """
+        Откладывает задачу чата, не занимая воркер: на delay секунд или, без
+        delay, до конца текущей отправки в чат. Все отложенные задачи чата
+        вернутся в очередь разом и в прежнем порядке.
+        """
+        parked = self._parked.setdefault(job.chat_id, deque())
+        if front:
+            parked.appendleft((priority, job))
+        else:
+            parked.append((priority, job))
+        self._parked_count += 1
+
+        if delay is not None:
+            self._schedule_release(job.chat_id, delay)
+
+    def _schedule_release(self, chat_id: int, delay: float):
+        if chat_id not in self._releases:
+            task = asyncio.ensure_future(self._release(chat_id, delay))
+            self._releases[chat_id] = task
+            task.add_done_callback(lambda done: self._forget_release(chat_id, done))
+
+    def _forget_release(self, chat_id: int, task: asyncio.Task):
+        if self._releases.get(chat_id) is task:
+            del self._releases[chat_id]
+
+    async def _release(self, chat_id: int, delay: float):
+        await asyncio.sleep(delay)
+        self._forget_release(chat_id, asyncio.current_task())
+        if chat_id in self._sending:
+            return  # Вернет в очередь завершение текущей отправки
+
+        parked = self._parked.pop(chat_id, None) or ()
+        self._parked_count -= len(parked)
+        for priority, job in parked:
+            await self._put(priority, job)
+
+    async def _worker(self):
+        while True:
+            priority, _, job = await self._queue.get()
+            self.queued_by_priority[priority] -= 1
+            try:
+                await self._process(priority, job)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, priority: Priority, job: _SendJob):
+        if job.future.done():
+            return  # Отправитель больше не ждет
+
+        # Пока у чата есть отложенные задачи или идет отправка, новые встают за ними
+        if job.chat_id in self._parked or job.chat_id in self._sending:
+            self._defer(priority, job)
+            return
+
+        delay = self._chat_bucket(job.chat_id).try_acquire()
+        if delay > 0:
+            self._defer(priority, job, delay)
+            return
+
+        self._sending.add(job.chat_id)
+        try:
+            await self._send(priority, job)
+        finally:
+            self._sending.discard(job.chat_id)
+            if job.chat_id in self._parked:
+                self._schedule_release(job.chat_id, 0)
+
+    async def _send(self, priority: Priority, job: _SendJob):
+        while (delay := self._global.try_acquire()) > 0:
+            await asyncio.sleep(delay)
+
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as e:
+            self._chat_bucket(job.chat_id).block(e.retry_after)
+            if job.attempt < self.MAX_ATTEMPTS:
+                self.retried += 1
+                logger.warning(f"⚠️ 429 для чата {job.chat_id}, повтор через {e.retry_after} с")
+                self._defer(priority, job._replace(attempt=job.attempt + 1), e.retry_after, front=True)
+                return
+            self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            latency = time.monotonic() - job.enqueued_at
+            self.sent += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def _fail(self, job: _SendJob, error: Exception):
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                # Полные ведра ничем не отличаются от новых - их можно забыть
+                for idle_chat_id in [key for key, value in self._chats.items() if value.idle]:
+                    del self._chats[idle_chat_id]
+
+            # В группах и каналах ID отрицательные, лимит у них строже
+            rate = self.private_rate if chat_id > 0 else self.group_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, max(1.0, rate * 3))
+        return bucket
@@ -0,0 +1,400 @@
+# services/sharding.py
+"""
+Обработка апдейтов в нескольких процессах.
+
+Фронт (ShardFront) - единственный процесс, который получает апдейты
+(polling или webhook). Он не выполняет обработчики, а отправляет каждый
+апдейт в процесс-воркер по ключу: пользователь, иначе чат. Все апдейты
+одного пользователя попадают в один воркер, а воркер (ShardWorker)
+обрабатывает их строго по очереди - порядок сохраняется, а разные
+пользователи обрабатываются параллельно.
+
+Воркеры - отдельные процессы с полным стеком бота: своим пулом БД
+с общей конфигурацией из Config, своей очередью отправки и своим
+Dispatcher. Упавший воркер перезапускается с нарастающей паузой;
+апдейты его шарда копятся у фронта и уходят новому процессу вместе
+с пачками, которые упавший не успел подтвердить.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Точка входа воркера: (номер шарда, канал апдейтов) -> None
+WorkerTarget = Callable[[int, Connection], None]
+
+# Сигнал воркеру: апдейтов больше не будет
+STOP = b""
+
+
+def update_shard_key(update: Update) -> int:
+    """Ключ шардинга: ID пользователя, иначе ID чата, иначе ID апдейта"""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    if user is not None:
+        return user.id
+
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        chat = getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+def shard_for(key: int, shards: int) -> int:
+    return key % shards
+
+
+def _worker_main(target: WorkerTarget, shard: int, updates: Connection):
+    # Ctrl+C приходит всей группе процессов - останавливает воркеры фронт
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    target(shard, updates)
+
+
+class _Shard:
+    """Процесс-воркер шарда и очередь его апдейтов у фронта"""
+
+    def __init__(self, index: int, max_queued: int, max_unacked: int):
+        self.index = index
+        self.pending: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=max_queued)
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.conn: Optional[Connection] = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.restart_delay = 0.0
+        self.restarting = False
+        self.pump: Optional[asyncio.Task] = None
+
+        # Пачки, которые воркер еще не подтвердил: номер -> пачка
+        self.unacked: Dict[int, bytes] = {}
+        self.window = asyncio.Semaphore(max_unacked)
+        self.sequence = itertools.count(1)
+        # Запись в канал: номер процесса и последняя отправленная ему пачка
+        self.lock = asyncio.Lock()
+        self.generation = 0
+        self.sent_generation = 0
+        self.sent_upto = 0
+
+
+class ShardFront(Dispatcher):
+    """
+    Dispatcher фронта: вместо обработки раздает апдейты воркерам.
+
+    Подставляется туда же, куда обычный Dispatcher - в start_polling
+    или WebhookServer. Воркеры запускаются на startup и останавливаются
+    на shutdown: фронт дожидается отправки накопленных апдейтов,
+    а воркеры - их обработки (не дольше drain_timeout секунд).
+
+    Воркер подтверждает пачку, когда обработал все ее апдейты. После
+    падения воркера неподтвержденные пачки уходят новому процессу
+    целиком, поэтому апдейт не теряется, но апдейты такой пачки, которые
+    упавший воркер успел обработать, обрабатываются повторно. Без
+    подтверждения у воркера может быть не больше max_unacked пачек.
+    """
+
+    BATCH_SIZE = 100
+    MAX_RESTART_DELAY = 30.0
+    # Воркер, проживший меньше этого, считается упавшим на старте
+    MIN_UPTIME = 10.0
+
+    def __init__(self, target: WorkerTarget, workers: int, max_queued: int = 1000,
+                 max_unacked: int = 10, drain_timeout: float = 30.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        if workers < 1:
+            raise ValueError("Нужен хотя бы один воркер")
+
+        self.target = target
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_unacked = max_unacked
+        self.drain_timeout = drain_timeout
+
+        self._context = multiprocessing.get_context("spawn")
+        # Свои потоки для записи в каналы: заблокированная запись не занимает общий пул
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._shards: List[_Shard] = []
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = False
+
+        self.startup.register(self._start_workers)
+        self.shutdown.register(self._stop_workers)
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        if self._stopping:
+            raise RuntimeError("Фронт останавливается")
+
+        shard = self._shards[shard_for(update_shard_key(update), self.workers)]
+        # Ждем места в очереди шарда - так медленный воркер тормозит прием
+        await shard.pending.put(update.model_dump_json(exclude_unset=True).encode())
+        return None
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {
+            f"shard_{shard.index}": {
+                "alive": bool(shard.process and shard.process.is_alive()),
+                "pid": shard.process.pid if shard.process else None,
+                "queued": shard.pending.qsize(),
+                "unacked": len(shard.unacked),
+                "restarts": shard.restarts,
+            }
+            for shard in self._shards
+        }
+
+    async def _start_workers(self):
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="nois-shard")
+        self._shards = [_Shard(index, self.max_queued, self.max_unacked) for index in range(self.workers)]
+        for shard in self._shards:
+            self._spawn(shard)
+            shard.pump = self._run_task(self._pump(shard))
+        self._run_task(self._supervise())
+        logger.info(f"✅ Запущено воркеров: {self.workers}")
+
+    async def _stop_workers(self):
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+
+        # STOP встает за накопленными апдейтами: воркер получит их все и завершится
+        stops = [asyncio.create_task(shard.pending.put(STOP)) for shard in self._shards]
+        await asyncio.wait([shard.pump for shard in self._shards], timeout=self.drain_timeout)
+
+        tasks = stops + list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        await asyncio.gather(*[self._join(shard, max(0.0, deadline - loop.time())) for shard in self._shards])
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+        lost = sum(shard.pending.qsize() for shard in self._shards if not shard.pump.done())
+        unacked = sum(len(shard.unacked) for shard in self._shards)
+        if lost or unacked:
+            logger.warning(f"⚠️ Не переданы воркерам {lost} апдейтов, не подтверждено пачек: {unacked}")
+        logger.info("✅ Воркеры остановлены")
+
+    async def _join(self, shard: _Shard, timeout: float):
+        await asyncio.to_thread(shard.process.join, timeout)
+        if shard.process.is_alive():
+            logger.warning(f"⚠️ Воркер {shard.index} не завершился за {self.drain_timeout} с, останавливаем")
+            shard.process.terminate()
+            await asyncio.to_thread(shard.process.join, 5.0)
+        self._close_conn(shard)
+
+    def _spawn(self, shard: _Shard):
+        front_end, worker_end = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main, args=(self.target, shard.index, worker_end),
+            # Не daemon: у воркера свой пул процессов для аватарок. Без фронта
+            # воркер завершается сам (см. ShardWorker._receive)
+            name=f"nois-shard-{shard.index}",
+        )
+        process.start()
+        # Без копии конца воркера у фронта канал мертвого воркера закрывается
+        worker_end.close()
+
+        self._close_conn(shard)
+        shard.process = process
+        shard.conn = front_end
+        shard.generation += 1
+        shard.started_at = asyncio.get_running_loop().time()
+        asyncio.get_running_loop().add_reader(front_end.fileno(), self._read_acks, shard, front_end)
+        logger.info(f"✅ Воркер {shard.index} запущен (pid {process.pid})")
+
+    def _close_conn(self, shard: _Shard):
+        if shard.conn is not None and not shard.conn.closed:
+            asyncio.get_running_loop().remove_reader(shard.conn.fileno())
+            shard.conn.close()
+
+    def _read_acks(self, shard: _Shard, conn: Connection):
+        try:
+            while conn.poll():
+                seq = int.from_bytes(conn.recv_bytes(), "big")
+                if shard.unacked.pop(seq, None) is not None:
+                    shard.window.release()
+        except (EOFError, OSError):
+            # Воркер завершился - канал закроет его перезапуск или остановка
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+
+    def _run_task(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _pump(self, shard: _Shard):
+        """Передает апдейты шарда воркеру пачками, в порядке получения"""
+        while True:
+            batch = [await shard.pending.get()]
+            while batch[-1] != STOP and len(batch) < self.BATCH_SIZE and not shard.pending.empty():
+                batch.append(shard.pending.get_nowait())
+
+            stop = batch[-1] == STOP
+            if stop:
+                batch.pop()
+            if batch:
+                await shard.window.acquire()
+                shard.unacked[next(shard.sequence)] = b"[" + b",".join(batch) + b"]"
+                await self._transmit(shard)
+            if stop:
+                async with shard.lock:
+                    await self._write(shard, STOP)
+                return
+
+    async def _transmit(self, shard: _Shard):
+        """Досылает воркеру неотправленные пачки; новому процессу - все неподтвержденные"""
+        async with shard.lock:
+            while True:
+                try:
+                    if shard.sent_generation != shard.generation:
+                        shard.sent_generation = shard.generation
+                        shard.sent_upto = 0
+                    for seq, payload in list(shard.unacked.items()):
+                        if seq > shard.sent_upto:
+                            await self._write(shard, seq.to_bytes(8, "big") + payload)
+                            shard.sent_upto = seq
+                    return
+                except OSError:
+                    # Воркер упал - пачки получит перезапущенный процесс
+                    await asyncio.sleep(0.5)
+
+    async def _write(self, shard: _Shard, frame: bytes):
+        # Блокируется, пока воркер не разберет канал - это и есть обратное давление
+        await asyncio.get_running_loop().run_in_executor(self._executor, shard.conn.send_bytes, frame)
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(1.0)
+            for shard in self._shards:
+                if not (shard.restarting or shard.process.is_alive() or self._stopping):
+                    # Каждый шард ждет своей паузы отдельно - остальные перезапускаются сразу
+                    shard.restarting = True
+                    self._run_task(self._restart(shard))
+
+    async def _restart(self, shard: _Shard):
+        try:
+            uptime = asyncio.get_running_loop().time() - shard.started_at
+            logger.error(f"❌ Воркер {shard.index} завершился с кодом {shard.process.exitcode} "
+                         f"через {uptime:.0f} с")
+            if uptime < self.MIN_UPTIME:
+                shard.restart_delay = min(self.MAX_RESTART_DELAY, max(1.0, shard.restart_delay * 2))
+            else:
+                shard.restart_delay = 0.0
+            if shard.restart_delay:
+                logger.info(f"⏳ Перезапуск воркера {shard.index} через {shard.restart_delay:.0f} с")
+                await asyncio.sleep(shard.restart_delay)
+
+            if self._stopping:
+                return
+            shard.restarts += 1
+            self._spawn(shard)
+            # Неподтвержденные пачки уходят новому процессу, даже если новых апдейтов нет
+            self._run_task(self._transmit(shard))
+        finally:
+            shard.restarting = False
+
+
+class ShardWorker:
+    """
+    Прием апдейтов своего шарда в процессе-воркере.
+
+    Апдейты одного ключа (update_shard_key) обрабатываются строго
+    по очереди, разных - параллельно, но не больше max_concurrent
+    одновременно. Когда обработаны все апдейты пачки, воркер
+    подтверждает ее фронту. Работает до сигнала STOP или завершения
+    фронта, затем дорабатывает начатое.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, updates: Connection, shard: int,
+                 max_concurrent: int = 100):
+        self.bot = bot
+        self.dp = dp
+        self.updates = updates
+        self.shard = shard
+
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.received = 0
+        self.failed = 0
+
+    async def run(self):
+        workflow_data = {"dispatcher": self.dp, "bots": [self.bot], **self.dp.workflow_data}
+        await self.dp.emit_startup(bot=self.bot, **workflow_data)
+        logger.info(f"✅ Воркер {self.shard} принимает апдейты")
+
+        try:
+            while (frame := await asyncio.to_thread(self._receive)) != STOP:
+                seq = int.from_bytes(frame[:8], "big")
+                tasks = [await self._dispatch(Update.model_validate(data, context={"bot": self.bot}))
+                         for data in json.loads(frame[8:])]
+                ack = asyncio.create_task(self._ack(seq, tasks))
+                self._tasks.add(ack)
+                ack.add_done_callback(self._tasks.discard)
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.dp.emit_shutdown(bot=self.bot, **workflow_data)
+            logger.info(f"✅ Воркер {self.shard} остановлен: получено {self.received}, ошибок {self.failed}")
+
+    def _receive(self) -> bytes:
+        parent = multiprocessing.parent_process()
+        while not self.updates.poll(1.0):
+            if parent is not None and not parent.is_alive():
+                return STOP
+        try:
+            return self.updates.recv_bytes()
+        except EOFError:
+            return STOP
+
+    async def _ack(self, seq: int, tasks: List[asyncio.Task]):
+        await asyncio.wait(tasks)
+        try:
+            self.updates.send_bytes(seq.to_bytes(8, "big"))
+        except OSError:
+            pass  # Фронт уже завершился
+
+    async def _dispatch(self, update: Update) -> asyncio.Task:
+        # Слот занимается до чтения следующего апдейта - иначе воркер копил бы их в памяти
+        await self._slots.acquire()
+        self.received += 1
+
+        key = update_shard_key(update)
+        task = asyncio.create_task(self._process(update, self._tails.get(key)))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return task
+
+    def _finish(self, key: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _process(self, update: Update, previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._slots.release()
@@ -0,0 +1,146 @@
+# services/webhook_server.py
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Прием апдейтов через webhook вместо long polling.
+
+    Запрос без верного секретного заголовка отклоняется с 401. Апдейт
+    обрабатывается в фоне, а Telegram сразу получает 200. Одновременно
+    обрабатывается не больше max_concurrent апдейтов: когда лимит занят,
+    ответ задерживается, и Telegram сам сбавляет темп. При остановке
+    (SIGTERM/SIGINT) новые апдейты получают 503 - Telegram повторит их
+    на другом экземпляре за балансировщиком, - а начатые дорабатываются
+    не дольше drain_timeout секунд.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, base_url: str, secret: str, path: str = "/webhook",
+                 host: str = "0.0.0.0", port: int = 8080, max_concurrent: int = 100,
+                 drain_timeout: float = 30.0):
+        self.bot = bot
+        self.dp = dp
+        self.url = base_url.rstrip("/") + path
+        self.secret = secret
+        self.path = path
+        self.host = host
+        self.port = port
+        self.max_concurrent = max_concurrent
+        self.drain_timeout = drain_timeout
+
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping: Optional[asyncio.Event] = None
+        self._draining = False
+
+        self.received = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def run(self):
+        """Запускает сервер, регистрирует webhook и работает до сигнала остановки"""
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self._stopping.set)
+            except NotImplementedError:  # Windows
+                pass
+
+        workflow_data = {"dispatcher": self.dp, "bots": [self.bot], **self.dp.workflow_data}
+        await self.dp.emit_startup(bot=self.bot, **workflow_data)
+
+        runner = web.AppRunner(self.create_app())
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+
+        # Несколько экземпляров регистрируют один и тот же URL - это безопасно
+        await self.bot.set_webhook(
+            self.url,
+            secret_token=self.secret,
+            allowed_updates=self.dp.resolve_used_update_types(),
+            max_connections=min(self.max_concurrent, 100),
+        )
+        logger.info(f"✅ Webhook {self.url} принимает апдейты на {self.host}:{self.port}")
+
+        try:
+            await self._stopping.wait()
+        finally:
+            await self._drain()
+            await runner.cleanup()
+            await self.dp.emit_shutdown(bot=self.bot, **workflow_data)
+
+    def stop(self):
+        if self._stopping:
+            self._stopping.set()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            return web.Response(status=401)
+        if self._draining:
+            return web.Response(status=503)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError as e:
+            logger.warning(f"⚠️ Некорректный апдейт: {e}")
+            return web.Response(status=400)
+
+        # Ждем свободный слот до ответа - так лимит давит на Telegram, а не на память
+        await self._slots.acquire()
+        self.received += 1
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        status = 503 if self._draining else 200
+        return web.json_response({
+            "draining": self._draining,
+            "in_flight": len(self._tasks),
+            "received": self.received,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }, status=status)
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+
+    async def _drain(self):
+        self._draining = True
+        if not self._tasks:
+            return
+
+        logger.info(f"⏳ Дорабатываем {len(self._tasks)} апдейтов...")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+        if pending:
+            logger.warning(f"⚠️ Не успели обработать {len(pending)} апдейтов за {self.drain_timeout} с")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
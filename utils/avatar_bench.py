@@ -0,0 +1,256 @@
+# utils/avatar_bench.py
+"""
+Бенчмарк рендера аватарок по этапам.
+
+Запуск:
+    python -m utils.avatar_bench [--sizes 64 128 256 512] [--iterations 5]
+                                 [--report avatar_bench.json]
+                                 [--baseline old.json] [--threshold 0.25]
+
+Каждый этап замеряется для каждого размера дважды: "cold" - перед каждой
+итерацией кеши слоев сбрасываются, "warm" - кеши прогреты. Каждый замер
+идет в отдельном процессе, чтобы пиковая память не зависела от соседей.
+Быстрые этапы повторяются, пока суммарное время не наберет --min-time,
+иначе медиана из пяти замеров по 1 мс - это шум.
+
+Пиковая память - прирост RSS за одну итерацию. На Linux пик процесса
+сбрасывается перед каждой итерацией (/proc/self/clear_refs), поэтому
+прогрев и соседние этапы его не скрывают; на других системах остается
+только прирост ru_maxrss за весь замер.
+
+Отчет пишется в JSON. Если передан --baseline (отчет прошлого запуска),
+медиана времени и пиковая память сравниваются с ним, и при регрессии
+больше --threshold (и больше --min-delta-ms / --min-delta-kb в абсолютных
+величинах) скрипт завершается с кодом 1.
+"""
+import argparse
+import ctypes
+import ctypes.util
+import gc
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+COLOR1, COLOR2 = "#667eea", "#764ba2"
+# Потолок числа итераций для самых быстрых этапов
+MAX_ITERATIONS = 10000
+
+
+def _build_stage(stage: str, size: int) -> Callable[[], object]:
+    """Подготавливает этап и возвращает функцию одной итерации"""
+    from utils import avatars
+
+    if stage == "gradient":
+        return lambda: avatars.create_gradient_background(size, COLOR1, COLOR2)
+    if stage == "gradient_legacy":
+        return lambda: avatars.create_gradient_background(size, COLOR1, COLOR2, legacy=True)
+    if stage == "compose":
+        return lambda: avatars.compose_avatar("N", COLOR1, COLOR2, size)
+    if stage in ("png_save", "webp_save"):
+        image = avatars.compose_avatar("N", COLOR1, COLOR2, size)
+        fmt = stage.split("_")[0]
+        return lambda: avatars.encode_avatar(image, fmt)
+    if stage == "beautiful_avatar":
+        return lambda: avatars.render_beautiful_avatar("NOIS", (size,))
+    if stage == "random_avatar":
+        return lambda: avatars.render_random_avatar("NOIS", (size,))
+    if stage == "avatar_set":
+        return lambda: avatars.render_beautiful_avatar("NOIS", avatars.get_render_sizes(size))
+    raise ValueError(f"Неизвестный этап: {stage}")
+
+
+STAGES = ("gradient", "compose", "png_save", "webp_save", "beautiful_avatar", "random_avatar", "avatar_set")
+
+
+def _max_rss_kb() -> int:
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдает байты, Linux - килобайты
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss
+
+
+def _load_libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"))
+    except OSError:
+        return None
+
+
+_libc = _load_libc() if sys.platform.startswith("linux") else None
+
+
+def _reset_peak_rss() -> Optional[int]:
+    """
+    Возвращает освобожденную память системе и сбрасывает пик RSS до текущего.
+    Результат - текущий RSS в КБ или None, если сброс не поддерживается.
+    """
+    gc.collect()
+    if _libc is not None and hasattr(_libc, "malloc_trim"):
+        # Иначе память прошлой итерации остается в куче и повторно не учитывается
+        _libc.malloc_trim(0)
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return _proc_status_kb("VmRSS")
+    except OSError:
+        return None
+
+
+def _proc_status_kb(field: str) -> int:
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise OSError(f"Нет поля {field} в /proc/self/status")
+
+
+def measure_stage(stage: str, size: int, mode: str, iterations: int, min_time_ms: float = 0.0) -> Dict[str, float]:
+    """Замер одного этапа; выполняется в отдельном процессе"""
+    from utils.avatars import clear_layer_cache
+
+    run = _build_stage(stage, size)
+    if mode == "warm":
+        run()
+
+    # Время: не меньше iterations итераций и не меньше min_time_ms в сумме
+    tracemalloc.start()
+    timings = []
+    while len(timings) < iterations or (sum(timings) < min_time_ms and len(timings) < MAX_ITERATIONS):
+        if mode == "cold":
+            clear_layer_cache()
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Память - отдельным проходом, чтобы замер не влиял на время
+    rss_before = _max_rss_kb()
+    peak_rss = 0
+    for _ in range(iterations):
+        if mode == "cold":
+            clear_layer_cache()
+        baseline = _reset_peak_rss()
+        result = run()
+        if baseline is not None:
+            peak_rss = max(peak_rss, _proc_status_kb("VmHWM") - baseline)
+        del result
+    if _reset_peak_rss() is None:
+        peak_rss = max(0, _max_rss_kb() - rss_before)
+
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "min_ms": round(timings[0], 3),
+        # RSS видит память Pillow, tracemalloc - только Python и NumPy
+        "peak_rss_kb": peak_rss,
+        "peak_traced_kb": traced_peak // 1024,
+    }
+
+
+def run_benchmark(stages: List[str], sizes: List[int], iterations: int, min_time_ms: float = 0.0) -> Dict:
+    results = {}
+    context = multiprocessing.get_context("spawn")
+
+    for stage in stages:
+        for size in sizes:
+            for mode in ("cold", "warm"):
+                with context.Pool(1) as pool:
+                    result = pool.apply(measure_stage, (stage, size, mode, iterations, min_time_ms))
+                name = f"{stage}/{size}/{mode}"
+                results[name] = result
+                print(f"   {name:<28} median {result['median_ms']:>9.2f} ms   "
+                      f"p95 {result['p95_ms']:>9.2f} ms   rss +{result['peak_rss_kb']} KB   "
+                      f"x{result['iterations']}")
+
+    import numpy
+    import PIL
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pillow": PIL.__version__,
+            "numpy": numpy.__version__,
+            "iterations": iterations,
+            "min_time_ms": min_time_ms,
+        },
+        "results": results,
+    }
+
+
+def find_regressions(report: Dict, baseline: Dict, threshold: float,
+                     min_delta_ms: float = 1.0, min_delta_kb: int = 256) -> List[str]:
+    """
+    Этапы, где медиана времени или пиковая память выросли больше порога.
+    Рост меньше min_delta_ms / min_delta_kb - шум и регрессией не считается.
+    """
+    min_deltas = {"median_ms": min_delta_ms, "peak_rss_kb": min_delta_kb}
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+
+        for metric, min_delta in min_deltas.items():
+            old, new = previous.get(metric, 0), current[metric]
+            if old > 0 and new > old * (1 + threshold) and new - old > min_delta:
+                regressions.append(f"{name} {metric}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m utils.avatar_bench", description="Бенчмарк рендера аватарок")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES),
+                        help=f"Этапы: {', '.join(STAGES)}, gradient_legacy")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[64, 128, 256, 512])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=200.0,
+                        help="Минимальное суммарное время замера, мс: быстрые этапы повторяются дольше")
+    parser.add_argument("--report", default="avatar_bench.json", help="Куда записать отчет")
+    parser.add_argument("--baseline", help="Отчет прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Допустимый рост медианы и памяти (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="Рост медианы меньше этого (мс) не считается регрессией")
+    parser.add_argument("--min-delta-kb", type=int, default=256,
+                        help="Рост пиковой памяти меньше этого (КБ) не считается регрессией")
+    args = parser.parse_args(argv)
+
+    print("=== БЕНЧМАРК АВАТАРОК ===")
+    report = run_benchmark(args.stages, args.sizes, args.iterations, args.min_time)
+
+    with open(args.report, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"\n📄 Отчет: {args.report}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+        regressions = find_regressions(report, baseline, args.threshold, args.min_delta_ms, args.min_delta_kb)
+        if regressions:
+            print(f"\n❌ Регрессии больше {args.threshold * 100:.0f}%:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print("\n✅ Регрессий нет")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# utils/avatar_prewarm.py
+"""
+Пакетный прогрев аватарок всех зарегистрированных пользователей.
+
+Запуск:
+    python -m utils.avatars prewarm [--force] [--workers N] [--batch-size N] [--restart]
+
+Пользователи читаются из БД страницами по user_id, недостающие аватарки
+рендерятся параллельно на всех ядрах. После каждой страницы последний
+user_id пишется в файл прогресса, поэтому прерванный запуск продолжается
+с того же места. Прогресс не уходит дальше первого пользователя, чью
+аватарку не удалось отрисовать, - следующий запуск начнет с него.
+После смены палитры или шрифта нужен --force.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from services.avatar_renderer import AvatarRenderer
+from utils.avatars import AVATAR_FORMATS, AVATAR_SIZES, AVATARS_DIR, avatar_store
+
+CHECKPOINT_PATH = os.path.join(AVATARS_DIR, ".prewarm_checkpoint")
+
+
+def has_full_set(nickname: str) -> bool:
+    """Есть ли у пользователя все размеры и форматы аватарки"""
+    variants = avatar_store.get_set(nickname)
+    return all((size, fmt) in variants for size in AVATAR_SIZES for fmt in AVATAR_FORMATS)
+
+
+def read_checkpoint() -> Optional[int]:
+    try:
+        with open(CHECKPOINT_PATH, encoding="utf-8") as file:
+            return int(file.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_checkpoint(user_id: int):
+    tmp_path = f"{CHECKPOINT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(str(user_id))
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+async def prewarm(force: bool = False, workers: Optional[int] = None, batch_size: int = 500,
+                  restart: bool = False):
+    """Рендерит недостающие (или все при force) аватарки пользователей из БД"""
+    from db.database import Database
+
+    db = Database()
+    await db.connect()
+    await asyncio.to_thread(avatar_store.load)
+    renderer = AvatarRenderer(max_workers=workers, max_pending=batch_size)
+
+    after_user_id = None if restart else read_checkpoint()
+    if after_user_id is not None:
+        print(f"↩️ Продолжаем после user_id={after_user_id}")
+
+    total = await db.get_users_count()
+    processed = rendered = failed = 0
+    # После первой ошибки прогресс больше не сохраняется
+    checkpoint_frozen = False
+    started = time.perf_counter()
+
+    try:
+        async for users in db.iter_users(batch_size, after_user_id):
+            todo = [user for user in users if force or not has_full_set(user["nickname"])]
+
+            results = await asyncio.gather(
+                *[renderer.regenerate_avatar(user["nickname"], max(AVATAR_SIZES)) for user in todo],
+                return_exceptions=True
+            )
+            failed_ids = set()
+            for user, result in zip(todo, results):
+                if isinstance(result, Exception):
+                    failed += 1
+                    failed_ids.add(user["user_id"])
+                    print(f"   ❌ {user['nickname']}: {result}")
+                else:
+                    rendered += 1
+
+            processed += len(users)
+            if not checkpoint_frozen:
+                done = users
+                for index, user in enumerate(users):
+                    if user["user_id"] in failed_ids:
+                        done, checkpoint_frozen = users[:index], True
+                        break
+                if done:
+                    write_checkpoint(done[-1]["user_id"])
+
+            elapsed = time.perf_counter() - started
+            print(
+                f"⏳ {processed}/{total} пользователей | отрисовано {rendered}, ошибок {failed} | "
+                f"{processed / elapsed:.1f} польз/с, {rendered / elapsed:.1f} аватарок/с"
+            )
+
+        # Весь список пройден без ошибок - следующий запуск начнется сначала
+        if checkpoint_frozen:
+            resume_after = read_checkpoint()
+            print("↩️ Следующий запуск повторит пользователей "
+                  + (f"после user_id={resume_after}" if resume_after is not None else "с начала"))
+        elif os.path.exists(CHECKPOINT_PATH):
+            os.remove(CHECKPOINT_PATH)
+
+        elapsed = time.perf_counter() - started
+        print(f"\n✅ Готово за {elapsed:.1f} с: {processed} пользователей, {rendered} отрисовано, {failed} ошибок")
+
+    finally:
+        await renderer.close()
+        await db.disconnect()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m utils.avatars", description="Утилиты аватарок NOIS")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prewarm_parser = commands.add_parser("prewarm", help="Прогреть аватарки всех пользователей")
+    prewarm_parser.add_argument("--force", action="store_true",
+                                help="Перерисовать все аватарки (после смены палитры или шрифта)")
+    prewarm_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                                help="Количество процессов рендера (по умолчанию - все ядра)")
+    prewarm_parser.add_argument("--batch-size", type=int, default=500,
+                                help="Пользователей на страницу и между сохранениями прогресса")
+    prewarm_parser.add_argument("--restart", action="store_true",
+                                help="Игнорировать сохраненный прогресс и начать сначала")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "prewarm":
+        asyncio.run(prewarm(args.force, args.workers, args.batch_size, args.restart))
@@ -0,0 +1,349 @@
+# utils/avatar_store.py
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows: межпроцессной блокировки нет, хранилищем пользуется один процесс
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Имена файлов до появления хранилища: Nick_<md5[:8]>.png и Nick_<timestamp>.png
+LEGACY_FILENAME_RE = re.compile(r"^(?P<nickname>.+)_(?:(?P<hash>[0-9a-f]{8})|(?P<timestamp>\d{10}))\.png$")
+
+
+class AvatarKey(NamedTuple):
+    """Ключ индекса: чья аватарка, какого размера, варианта и формата"""
+    nickname: str
+    size: int
+    variant: str
+    fmt: str
+
+
+class AvatarEntry(NamedTuple):
+    """Одна версия аватарки в индексе"""
+    file: str
+    sha256: str
+
+
+class AvatarStore:
+    """
+    Хранилище аватарок с адресацией по содержимому.
+
+    Файлы называются по хэшу содержимого, поэтому одинаковые картинки
+    (та же буква и та же пара цветов) хранятся один раз. Индекс
+    (никнейм, размер, вариант, формат) -> файл живет в памяти и пишется
+    в журнал index.jsonl, который перечитывается один раз при старте.
+
+    Для каждого варианта хранится ограниченная история версий:
+    у "default" - только текущая, у "random" - последние keep_random.
+    Вытесненные файлы, на которые больше никто не ссылается, удаляются.
+
+    Хранилищем могут одновременно пользоваться несколько процессов
+    (воркеры шардов, прогрев аватарок). Изменения идут под файловой
+    блокировкой, и перед ними процесс дочитывает чужие записи журнала -
+    поэтому счетчики ссылок, по которым удаляются файлы, общие для всех.
+    Чтения тоже дочитывают журнал, если он вырос. Журнал сжимается при
+    загрузке, только когда в нем больше половины устаревших записей.
+    """
+
+    JOURNAL_NAME = "index.jsonl"
+    LOCK_NAME = ".lock"
+
+    def __init__(self, root: str, keep_random: int = 3):
+        self.root = root
+        self.retention = {"default": 1, "random": keep_random}
+
+        self._entries: Dict[AvatarKey, List[AvatarEntry]] = {}
+        self._refs: Counter = Counter()
+        self._lock = threading.RLock()
+        self._loaded = False
+
+        # Прочитанная часть журнала: файл (inode), байты и строки
+        self._journal_ino: Optional[int] = None
+        self._journal_offset = 0
+        self._journal_lines = 0
+
+    @property
+    def journal_path(self) -> str:
+        return os.path.join(self.root, self.JOURNAL_NAME)
+
+    def load(self):
+        """Загрузка индекса из журнала (или импорт старых файлов при первом запуске)"""
+        with self._lock:
+            if self._loaded:
+                return
+
+            os.makedirs(self.root, exist_ok=True)
+            with self._exclusive():
+                if self._journal_ino is None:
+                    self._import_legacy_files()
+                    self._compact_journal()
+                elif self._journal_lines > 2 * self._live_entries():
+                    self._compact_journal()
+
+            self._loaded = True
+            logger.info(f"✅ Индекс аватарок загружен: {len(self._entries)} записей, {len(self._refs)} файлов")
+
+    def get(self, nickname: str, size: int, variant: str = "default", fmt: str = "png") -> Optional[str]:
+        """Путь к текущей версии аватарки или None"""
+        self.load()
+        with self._lock:
+            self._refresh()
+            history = self._entries.get(AvatarKey(nickname, size, variant, fmt))
+            if not history:
+                return None
+            return os.path.join(self.root, history[-1].file)
+
+    def get_set(self, nickname: str, variant: str = "default") -> Dict[Tuple[int, str], str]:
+        """Все размеры и форматы текущей версии: {(размер, формат): путь}"""
+        self.load()
+        with self._lock:
+            self._refresh()
+            return {
+                (key.size, key.fmt): os.path.join(self.root, history[-1].file)
+                for key, history in self._entries.items()
+                if key.nickname == nickname and key.variant == variant and history
+            }
+
+    def put(self, nickname: str, size: int, data: bytes, variant: str = "default", fmt: str = "png") -> str:
+        """
+        Сохраняет новую версию аватарки и возвращает путь к файлу.
+        Если такая же картинка уже есть, новый файл не создается.
+        """
+        return self.put_set(nickname, {(size, fmt): data}, variant)[(size, fmt)]
+
+    def put_set(self, nickname: str, images: Dict[Tuple[int, str], bytes],
+                variant: str = "default") -> Dict[Tuple[int, str], str]:
+        """
+        Сохраняет набор размеров и форматов одной версии аватарки.
+
+        Args:
+            nickname: Никнейм пользователя
+            images: {(размер, формат): содержимое файла}
+            variant: Вариант аватарки ("default" или "random")
+
+        Returns:
+            Dict[Tuple[int, str], str]: {(размер, формат): путь к файлу}
+        """
+        self.load()
+        paths = {}
+        with self._exclusive():
+            for (size, fmt), data in images.items():
+                sha256 = hashlib.sha256(data).hexdigest()
+                entry = AvatarEntry(f"{sha256[:32]}.{fmt}", sha256)
+                filepath = os.path.join(self.root, entry.file)
+                if not os.path.exists(filepath):
+                    self._write_atomic(filepath, data)
+
+                key = AvatarKey(nickname, size, variant, fmt)
+                self._push(key, entry)
+                self._append_journal(key, entry)
+                paths[(size, fmt)] = filepath
+
+        return paths
+
+    def gc(self) -> int:
+        """
+        Удаляет файлы хранилища, на которые не ссылается индекс
+        (например, оставшиеся после сбоя между записью файла и журнала).
+
+        Returns:
+            int: Количество удаленных файлов
+        """
+        self.load()
+        removed = 0
+        with self._exclusive():
+            for filename in os.listdir(self.root):
+                name, _, ext = filename.partition(".")
+                is_store_file = len(name) == 32 and all(c in "0123456789abcdef" for c in name)
+                if is_store_file and filename not in self._refs:
+                    os.remove(os.path.join(self.root, filename))
+                    removed += 1
+
+            self._compact_journal()
+
+        if removed:
+            logger.info(f"🧹 Удалено неиспользуемых аватарок: {removed}")
+        return removed
+
+    def _push(self, key: AvatarKey, entry: AvatarEntry, delete_files: bool = True):
+        """Добавляет версию в историю варианта и вытесняет лишние"""
+        history = self._entries.setdefault(key, [])
+        if history and history[-1] == entry:
+            return
+
+        history.append(entry)
+        self._refs[entry.file] += 1
+
+        keep = self.retention.get(key.variant, 1)
+        while len(history) > keep:
+            self._release(history.pop(0), delete_files)
+
+    def _release(self, entry: AvatarEntry, delete_file: bool = True):
+        """Снимает ссылку на файл и удаляет его, если ссылок не осталось"""
+        self._refs[entry.file] -= 1
+        if self._refs[entry.file] > 0:
+            return
+
+        del self._refs[entry.file]
+        if delete_file:
+            try:
+                os.remove(os.path.join(self.root, entry.file))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """
+        Изменение хранилища: блокировка для потоков и других процессов
+        и актуальный индекс с их записями.
+        """
+        with self._lock, open(os.path.join(self.root, self.LOCK_NAME), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh()
+            yield
+            # Свои строки журнала уже в индексе
+            self._journal_offset = os.path.getsize(self.journal_path)
+
+    def _refresh(self):
+        """Дочитывает журнал; если его переписали (сжатие), перечитывает целиком"""
+        # Чтения идут на каждую аватарку - без изменений обходимся одним stat
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino == self._journal_ino and stat.st_size == self._journal_offset:
+            return
+
+        try:
+            journal = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            return
+
+        with journal:
+            stat = os.fstat(journal.fileno())
+            # Журнал короче прочитанного - его переписали, даже если inode совпал
+            if stat.st_ino != self._journal_ino or stat.st_size < self._journal_offset:
+                self._entries.clear()
+                self._refs.clear()
+                self._journal_ino = stat.st_ino
+                self._journal_offset = self._journal_lines = 0
+                self._replay_journal(journal)
+                self._drop_missing_files()
+            elif stat.st_size > self._journal_offset:
+                self._replay_journal(journal)
+
+    def _replay_journal(self, journal):
+        """Применяет целые строки журнала после прочитанной части"""
+        journal.seek(self._journal_offset)
+        data = journal.read()
+        # Последняя строка может еще дописываться другим процессом
+        complete = data[:data.rfind(b"\n") + 1]
+        self._journal_offset += len(complete)
+
+        for line in complete.splitlines():
+            self._journal_lines += 1
+            try:
+                record = json.loads(line)
+                key = AvatarKey(record["nickname"], record["size"], record["variant"], record.get("format", "png"))
+                entry = AvatarEntry(record["file"], record["sha256"])
+            except (ValueError, KeyError):
+                # Оборванная строка после аварийного завершения
+                continue
+            # Вытесненные файлы удалил процесс, который записал эту строку
+            self._push(key, entry, delete_files=False)
+
+    def _live_entries(self) -> int:
+        return sum(len(history) for history in self._entries.values())
+
+    def _drop_missing_files(self):
+        # Файлы могли пропасть мимо хранилища - такие записи не нужны
+        for key, history in list(self._entries.items()):
+            for entry in [entry for entry in history if not os.path.exists(os.path.join(self.root, entry.file))]:
+                history.remove(entry)
+                self._release(entry, delete_file=False)
+            if not history:
+                del self._entries[key]
+
+    def _import_legacy_files(self):
+        """
+        Подхватывает аватарки, сохраненные до появления хранилища.
+
+        Файлы переименовываются по хэшу содержимого, как новые: одинаковые
+        старые рендеры схлопываются в один файл, а вытесненные версии
+        удаляются. Файлы Nick_<hash>.png с хэшем не от (ник, размер) -
+        тоже аватарки по умолчанию, просто из старой схемы имен.
+        """
+        legacy = []
+        for filename in os.listdir(self.root):
+            match = LEGACY_FILENAME_RE.match(filename)
+            if not match:
+                continue
+
+            filepath = os.path.join(self.root, filename)
+            try:
+                with Image.open(filepath) as image:
+                    size = image.width
+            except OSError:
+                continue
+
+            if match["hash"]:
+                # Текущей версией станет последняя сохраненная
+                legacy.append((os.path.getmtime(filepath), match["nickname"], size, "default", filename))
+            else:
+                legacy.append((int(match["timestamp"]), match["nickname"], size, "random", filename))
+
+        # Старые версии идут первыми, чтобы история вытеснялась по времени
+        for _, nickname, size, variant, filename in sorted(legacy):
+            filepath = os.path.join(self.root, filename)
+            with open(filepath, "rb") as file:
+                sha256 = hashlib.sha256(file.read()).hexdigest()
+
+            entry = AvatarEntry(f"{sha256[:32]}.png", sha256)
+            if os.path.exists(os.path.join(self.root, entry.file)):
+                os.remove(filepath)
+            else:
+                os.replace(filepath, os.path.join(self.root, entry.file))
+            self._push(AvatarKey(nickname, size, variant, "png"), entry)
+
+        if legacy:
+            logger.info(f"✅ Импортировано старых аватарок: {len(legacy)}, "
+                        f"после дедупликации файлов: {len(self._refs)}")
+
+    def _append_journal(self, key: AvatarKey, entry: AvatarEntry):
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            journal.write(self._journal_line(key, entry))
+        self._journal_lines += 1
+
+    def _compact_journal(self):
+        """Переписывает журнал, оставляя только актуальные записи"""
+        lines = [self._journal_line(key, entry) for key, history in self._entries.items() for entry in history]
+        self._write_atomic(self.journal_path, "".join(lines).encode("utf-8"))
+        self._journal_ino = os.stat(self.journal_path).st_ino
+        self._journal_offset = os.path.getsize(self.journal_path)
+        self._journal_lines = len(lines)
+
+    @staticmethod
+    def _journal_line(key: AvatarKey, entry: AvatarEntry) -> str:
+        record = {"nickname": key.nickname, "size": key.size, "variant": key.variant, "format": key.fmt,
+                  "file": entry.file, "sha256": entry.sha256}
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    @staticmethod
+    def _write_atomic(filepath: str, data: bytes):
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, filepath)
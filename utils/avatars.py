@@ -1,15 +1,45 @@
 # utils/avatars.py
-from typing import Tuple
+from typing import Dict, Iterable, NamedTuple, Tuple
 import os
 import random
 import hashlib
+import io
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
+import numpy as np
 import math
 
+from utils.avatar_store import AvatarStore
+
 # Создаем папку для кеширования аватарок, если её нет
 AVATARS_DIR = "data/avatars"
 os.makedirs(AVATARS_DIR, exist_ok=True)
 
+# Индекс готовых аватарок; загружается один раз при первом обращении
+avatar_store = AvatarStore(AVATARS_DIR)
+
+# Аватарки рисуются с запасом качества и полями под тень
+SUPERSAMPLE_FACTOR = 4
+SHADOW_MARGIN = 40
+
+# Размеры и форматы, которые рендерятся за один проход
+AVATAR_SIZES = (64, 128, 256, 512)
+AVATAR_FORMATS = ("png", "webp")
+
+# {(размер, формат): содержимое файла}
+AvatarImages = Dict[Tuple[int, str], bytes]
+
+# Шрифты для буквы в порядке предпочтения
+FONT_PATHS = (
+    "arialbd.ttf",
+    "C:\\Windows\\Fonts\\arialbd.ttf",
+    "C:\\Windows\\Fonts\\Arial\\arialbd.ttf",
+    "/System/Library/Fonts/Arial Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+)
+
 
 def generate_color() -> str:
     """
@@ -82,8 +112,53 @@ def generate_random_color_pair() -> Tuple[str, str]:
     return random.choice(all_color_pairs)
 
 
-def create_gradient_background(size: int, color1: str, color2: str) -> Image.Image:
-    """Создает градиентный фон максимального качества"""
+def create_gradient_background(size: int, color1: str, color2: str, legacy: bool = False) -> Image.Image:
+    """
+    Создает радиальный градиентный фон: color2 в центре, color1 по углам.
+
+    Args:
+        size: Размер фона в пикселях
+        color1: Цвет краев в HEX
+        color2: Цвет центра в HEX
+        legacy: Использовать старый рендер через концентрические эллипсы
+    """
+    if legacy:
+        return _create_gradient_background_legacy(size, color1, color2)
+
+    return Image.fromarray(_render_gradient_pixels(size, color1, color2, size), "RGBA")
+
+
+def _render_gradient_pixels(size: int, color1: str, color2: str, gradient_size: float) -> np.ndarray:
+    """
+    Пиксели радиального градиента размером gradient_size по центру холста size.
+    Таблица из 256 оттенков между цветами и готовое поле расстояний -
+    весь фон собирается одной индексацией массива.
+    """
+    start = np.array(hex_to_rgb(color2) + (255,), dtype=np.float32)
+    end = np.array(hex_to_rgb(color1) + (255,), dtype=np.float32)
+    steps = np.linspace(0.0, 1.0, 256, dtype=np.float32)[:, None]
+    palette = np.rint(start + (end - start) * steps).astype(np.uint8)
+
+    return palette[_get_radial_distance_field(size, gradient_size)]
+
+
+@lru_cache(maxsize=16)
+def _get_radial_distance_field(size: int, gradient_size: float) -> np.ndarray:
+    """
+    Поле расстояний от центра, квантованное в 0..255 (0 - центр, 255 - угол градиента).
+    Зависит только от размеров, поэтому считается один раз.
+    """
+    coords = np.arange(size, dtype=np.float32) - (size - 1) / 2
+    distance = np.hypot(coords[None, :], coords[:, None])
+    distance *= 255 / (gradient_size / 2 * math.sqrt(2))
+
+    field = np.rint(np.clip(distance, 0, 255)).astype(np.uint8)
+    field.setflags(write=False)
+    return field
+
+
+def _create_gradient_background_legacy(size: int, color1: str, color2: str) -> Image.Image:
+    """Старый градиент: рендер в 4 раза больше через эллипсы и LANCZOS"""
     # Увеличиваем размер для супер-качества
     super_size = size * 4  # Рендерим в 4 раза больше
 
@@ -97,14 +172,14 @@ def create_gradient_background(size: int, color1: str, color2: str) -> Image.Ima
     # Оптимизированный алгоритм с плавными переходами
     steps = min(200, max_radius)  # Ограничиваем количество шагов для производительности
 
+    r1, g1, b1 = hex_to_rgb(color1)
+    r2, g2, b2 = hex_to_rgb(color2)
+
     for i in range(steps):
         radius = max_radius * (1 - i / steps)
         ratio = i / steps
 
         # Плавная интерполяция цветов
-        r1, g1, b1 = int(color1[1:3], 16), int(color1[3:5], 16), int(color1[5:7], 16)
-        r2, g2, b2 = int(color2[1:3], 16), int(color2[3:5], 16), int(color2[5:7], 16)
-
         r = int(r1 * (1 - ratio) + r2 * ratio)
         g = int(g1 * (1 - ratio) + g2 * ratio)
         b = int(b1 * (1 - ratio) + b2 * ratio)
@@ -120,154 +195,145 @@ def create_gradient_background(size: int, color1: str, color2: str) -> Image.Ima
     return image
 
 
-def get_avatar_filename(nickname: str, size: int) -> str:
-    """Генерирует имя файла аватарки на основе никнейма и размера"""
-    safe_nickname = "".join(c for c in nickname if c.isalnum() or c in ('-', '_'))
-    # Добавляем хэш для уникальности и кеширования
-    content_hash = hashlib.md5(f"{nickname}_{size}".encode()).hexdigest()[:8]
-    return f"{safe_nickname}_{content_hash}.png"
-
-
-def create_beautiful_avatar(nickname: str, size: int = 512, force_regenerate: bool = False) -> Tuple[str, str]:
+def create_beautiful_avatar(nickname: str, size: int = 512, force_regenerate: bool = False,
+                            fmt: str = "png") -> Tuple[str, str]:
     """
     Создает или возвращает существующую красивую аватарку.
+    При рендере за один проход сохраняются все размеры из AVATAR_SIZES
+    во всех форматах из AVATAR_FORMATS.
 
     Args:
         nickname: Никнейм пользователя
         size: Размер аватарки (рекомендуется 512 или 1024)
         force_regenerate: Принудительно перегенерировать аватарку
+        fmt: Формат файла ("png" или "webp")
 
     Returns:
         Tuple[str, str]: (путь к файлу, основной цвет)
     """
-    # Генерируем имя файла
-    filename = get_avatar_filename(nickname, size)
-    filepath = os.path.join(AVATARS_DIR, filename)
+    # Если аватарка уже есть в хранилище и не нужно пересоздавать - возвращаем её
+    if not force_regenerate:
+        filepath = avatar_store.get(nickname, size, fmt=fmt)
+        if filepath:
+            color1, _ = generate_beautiful_color_pair(nickname)
+            return filepath, color1
+
+    images, color1 = render_beautiful_avatar(nickname, get_render_sizes(size))
+    return avatar_store.put_set(nickname, images)[(size, fmt)], color1
+
+
+def create_random_avatar(nickname: str, size: int = 512, fmt: str = "png") -> Tuple[str, str]:
+    """
+    Создает аватарку со СЛУЧАЙНЫМИ цветами градиента.
+    Цвета не зависят от никнейма - каждый раз новые.
+    """
+    images, color1 = render_random_avatar(nickname, get_render_sizes(size))
+    return avatar_store.put_set(nickname, images, variant="random")[(size, fmt)], color1
+
 
-    # Если аватарка уже существует и не нужно пересоздавать - возвращаем её
-    if not force_regenerate and os.path.exists(filepath):
-        color1, _ = generate_beautiful_color_pair(nickname)
-        return filepath, color1
+def get_render_sizes(size: int) -> Tuple[int, ...]:
+    """Размеры, которые рендерятся вместе с запрошенным"""
+    return tuple(sorted(set(AVATAR_SIZES) | {size}))
 
-    # Извлекаем первую букву никнейма (в верхнем регистре)
-    first_letter = nickname[0].upper()
 
-    # Увеличиваем размер для максимального качества
-    scale_factor = 4  # Рендерим в 4 раза больше
-    render_size = size * scale_factor
+def render_beautiful_avatar(nickname: str, sizes: Iterable[int] = AVATAR_SIZES) -> Tuple[AvatarImages, str]:
+    """
+    Рисует аватарку с цветами от никнейма, ничего не сохраняя.
+    Чистая функция - её можно выполнять в пуле процессов.
 
+    Returns:
+        Tuple[AvatarImages, str]: ({(размер, формат): содержимое файла}, основной цвет)
+    """
     # Генерируем детерминированные цвета
     color1, color2 = generate_beautiful_color_pair(nickname)
+    return render_avatar_set(nickname[0].upper(), color1, color2, sizes), color1
 
-    # Создаем градиентный фон максимального качества
-    gradient_bg = create_gradient_background(render_size, color1, color2)
 
-    # Добавляем тень с размытием
-    shadow_size = render_size + 80
-    shadow = Image.new("RGBA", (shadow_size, shadow_size), (0, 0, 0, 0))
-    shadow_draw = ImageDraw.Draw(shadow)
+def render_random_avatar(nickname: str, sizes: Iterable[int] = AVATAR_SIZES) -> Tuple[AvatarImages, str]:
+    """Рисует аватарку со случайными цветами, ничего не сохраняя"""
+    # Генерируем СЛУЧАЙНЫЕ цвета (не зависящие от никнейма)
+    color1, color2 = generate_random_color_pair()
+    return render_avatar_set(nickname[0].upper(), color1, color2, sizes), color1
 
-    # Рисуем тень с градиентом
-    shadow_radius = shadow_size // 2
-    for i in range(50, 0, -5):
-        alpha = max(5, 50 - i)
-        shadow_draw.ellipse([
-            shadow_radius - i, shadow_radius - i,
-            shadow_radius + i, shadow_radius + i
-        ], fill=(0, 0, 0, alpha))
 
-    shadow = shadow.filter(ImageFilter.GaussianBlur(25))
+def render_avatar_set(letter: str, color1: str, color2: str, sizes: Iterable[int] = AVATAR_SIZES,
+                      formats: Iterable[str] = AVATAR_FORMATS) -> AvatarImages:
+    """
+    Собирает аватарку один раз в наибольшем размере и получает
+    остальные размеры уменьшением мастер-картинки.
 
-    # Собираем финальное изображение
-    final_image = Image.new("RGBA", (shadow_size, shadow_size), (0, 0, 0, 0))
-    final_image.paste(shadow, (0, 0), shadow)
-
-    # Размещаем градиент по центру
-    gradient_pos = (shadow_size - render_size) // 2
-    final_image.paste(gradient_bg, (gradient_pos, gradient_pos), gradient_bg)
-
-    # Рисуем букву с максимальным качеством
-    try:
-        # Используем большой размер шрифта для качества
-        font_size = int(render_size * 0.6)
-
-        # Пробуем разные шрифты
-        font_paths = [
-            "arialbd.ttf",
-            "C:\\Windows\\Fonts\\arialbd.ttf",
-            "C:\\Windows\\Fonts\\Arial\\arialbd.ttf",
-            "/System/Library/Fonts/Arial Bold.ttf",
-            "/Library/Fonts/Arial Bold.ttf",
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-            "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf"
-        ]
-
-        font = None
-        for font_path in font_paths:
-            try:
-                font = ImageFont.truetype(font_path, font_size)
-                break
-            except:
-                continue
-
-        if font is None:
-            # Fallback на стандартный шрифт
-            font = ImageFont.load_default()
-
-    except Exception as e:
-        font = ImageFont.load_default()
-
-    # Рисуем букву по центру
-    center_x, center_y = shadow_size // 2, shadow_size // 2
-    draw_final = ImageDraw.Draw(final_image)
-
-    # Тень текста для лучшей читаемости
-    shadow_offset = int(render_size * 0.02)  # 2% от размера
-    shadow_color = (0, 0, 0, 120)
-    draw_final.text(
-        (center_x + shadow_offset, center_y + shadow_offset),
-        first_letter,
-        fill=shadow_color,
-        font=font,
-        anchor="mm"
-    )
+    Returns:
+        AvatarImages: {(размер, формат): содержимое файла}
+    """
+    sizes = sorted(set(sizes), reverse=True)
+    master = compose_avatar(letter, color1, color2, sizes[0])
 
-    # Основной текст
-    text_color = (255, 255, 255, 255)
-    draw_final.text((center_x, center_y), first_letter, fill=text_color, font=font, anchor="mm")
+    images = {}
+    for size in sizes:
+        image = master if size == master.width else master.resize((size, size), Image.Resampling.LANCZOS)
+        for fmt in formats:
+            images[(size, fmt)] = encode_avatar(image, fmt)
+    return images
 
-    # Уменьшаем до целевого размера с премиальным антиалиасингом
-    final_image = final_image.resize((size, size), Image.Resampling.LANCZOS)
 
-    # Сохраняем с максимальным качеством
-    final_image.save(filepath, "PNG", optimize=True, quality=95)
-    return filepath, color1
+def encode_avatar(image: Image.Image, fmt: str = "png") -> bytes:
+    """Кодирует аватарку в PNG с максимальным качеством или в компактный WebP"""
+    buffer = io.BytesIO()
+    if fmt == "webp":
+        image.save(buffer, "WEBP", quality=90)
+    else:
+        image.save(buffer, "PNG", optimize=True, quality=95)
+    return buffer.getvalue()
 
 
-def create_random_avatar(nickname: str, size: int = 512) -> Tuple[str, str]:
+def compose_avatar(letter: str, color1: str, color2: str, size: int) -> Image.Image:
     """
-    Создает аватарку со СЛУЧАЙНЫМИ цветами градиента.
-    Цвета не зависят от никнейма - каждый раз новые.
+    Собирает аватарку сразу в целевом размере: градиент в рамке поверх
+    готовой тени и две заливки по готовым маскам буквы. Все слои, кроме
+    градиента, берутся из кеша и зависят только от размера и буквы.
     """
-    first_letter = nickname[0].upper()
+    layout = _get_layout(size)
 
-    # Увеличиваем размер для качества
-    scale_factor = 4
-    render_size = size * scale_factor
+    gradient = Image.fromarray(
+        _render_gradient_pixels(size, color1, color2, size * layout.render_size / layout.canvas_size),
+        "RGBA"
+    )
+    gradient.putalpha(_get_frame_mask(size))
+    avatar = Image.alpha_composite(_get_shadow_layer(size), gradient)
+
+    # Тень текста для лучшей читаемости и основной текст
+    shadow_mask, text_mask = _get_glyph_masks(letter, size)
+    avatar.paste((0, 0, 0, 120), (0, 0), shadow_mask)
+    avatar.paste((255, 255, 255, 255), (0, 0), text_mask)
+    return avatar
 
-    # Генерируем СЛУЧАЙНЫЕ цвета (не зависящие от никнейма)
-    color1, color2 = generate_random_color_pair()
 
-    # Создаем градиентный фон
-    gradient_bg = create_gradient_background(render_size, color1, color2)
+def clear_layer_cache():
+    """Сбрасывает кеши слоев, шрифтов и полей расстояний (для замеров холодного старта)"""
+    for cached in (_get_radial_distance_field, _get_shadow_layer, _get_frame_mask, _get_font, _get_glyph_masks):
+        cached.cache_clear()
 
-    # Добавляем тень с размытием
-    shadow_size = render_size + 80
-    shadow = Image.new("RGBA", (shadow_size, shadow_size), (0, 0, 0, 0))
+
+class _AvatarLayout(NamedTuple):
+    """Геометрия аватарки в масштабе рендера"""
+    render_size: int  # Сторона градиента
+    canvas_size: int  # Сторона холста вместе с полями под тень
+
+
+def _get_layout(size: int) -> _AvatarLayout:
+    render_size = size * SUPERSAMPLE_FACTOR
+    return _AvatarLayout(render_size, render_size + 2 * SHADOW_MARGIN)
+
+
+@lru_cache(maxsize=8)
+def _get_shadow_layer(size: int) -> Image.Image:
+    """Размытая тень под аватаркой, уменьшенная до целевого размера"""
+    layout = _get_layout(size)
+    shadow = Image.new("RGBA", (layout.canvas_size, layout.canvas_size), (0, 0, 0, 0))
     shadow_draw = ImageDraw.Draw(shadow)
 
-    # Рисуем тень
-    shadow_radius = shadow_size // 2
+    # Рисуем тень с градиентом
+    shadow_radius = layout.canvas_size // 2
     for i in range(50, 0, -5):
         alpha = max(5, 50 - i)
         shadow_draw.ellipse([
@@ -277,61 +343,54 @@ def create_random_avatar(nickname: str, size: int = 512) -> Tuple[str, str]:
 
     shadow = shadow.filter(ImageFilter.GaussianBlur(25))
 
-    # Собираем финальное изображение
-    final_image = Image.new("RGBA", (shadow_size, shadow_size), (0, 0, 0, 0))
-    final_image.paste(shadow, (0, 0), shadow)
-    final_image.paste(gradient_bg, (40, 40), gradient_bg)  # 40 = (shadow_size - render_size) // 2
-
-    # Рисуем букву
-    try:
-        font_size = int(render_size * 0.6)
-        font_paths = [
-            "arialbd.ttf",
-            "C:\\Windows\\Fonts\\arialbd.ttf",
-            "/System/Library/Fonts/Arial Bold.ttf",
-        ]
-
-        font = None
-        for font_path in font_paths:
-            try:
-                font = ImageFont.truetype(font_path, font_size)
-                break
-            except:
-                continue
-        if font is None:
-            font = ImageFont.load_default()
-    except Exception as e:
-        font = ImageFont.load_default()
-
-    # Рисуем букву по центру
-    center_x, center_y = shadow_size // 2, shadow_size // 2
-    draw_final = ImageDraw.Draw(final_image)
-
-    # Тень текста
-    shadow_offset = int(render_size * 0.02)
-    draw_final.text(
-        (center_x + shadow_offset, center_y + shadow_offset),
-        first_letter,
-        fill=(0, 0, 0, 120),
-        font=font,
-        anchor="mm"
-    )
+    layer = Image.new("RGBA", shadow.size, (0, 0, 0, 0))
+    layer.paste(shadow, (0, 0), shadow)
+    return layer.resize((size, size), Image.Resampling.LANCZOS)
+
+
+@lru_cache(maxsize=8)
+def _get_frame_mask(size: int) -> Image.Image:
+    """Маска квадрата градиента внутри полей под тень"""
+    layout = _get_layout(size)
+    mask = Image.new("L", (layout.canvas_size, layout.canvas_size), 0)
+    ImageDraw.Draw(mask).rectangle([
+        SHADOW_MARGIN, SHADOW_MARGIN,
+        SHADOW_MARGIN + layout.render_size - 1, SHADOW_MARGIN + layout.render_size - 1
+    ], fill=255)
+    return mask.resize((size, size), Image.Resampling.LANCZOS)
+
 
-    # Основной текст
-    draw_final.text((center_x, center_y), first_letter, fill="white", font=font, anchor="mm")
+@lru_cache(maxsize=8)
+def _get_font(font_size: int) -> ImageFont.ImageFont:
+    """Первый доступный шрифт из FONT_PATHS нужного размера"""
+    for font_path in FONT_PATHS:
+        try:
+            return ImageFont.truetype(font_path, font_size)
+        except OSError:
+            continue
 
-    # Уменьшаем до целевого размера
-    final_image = final_image.resize((size, size), Image.Resampling.LANCZOS)
+    # Fallback на стандартный шрифт
+    return ImageFont.load_default()
 
-    # Сохраняем с уникальным именем (добавляем timestamp для уникальности)
-    import time
-    safe_nickname = "".join(c for c in nickname if c.isalnum() or c in ('-', '_'))
-    timestamp = int(time.time())
-    filename = f"{safe_nickname}_{timestamp}.png"
-    filepath = os.path.join(AVATARS_DIR, filename)
 
-    final_image.save(filepath, "PNG", optimize=True, quality=95)
-    return filepath, color1
+@lru_cache(maxsize=64)
+def _get_glyph_masks(letter: str, size: int) -> Tuple[Image.Image, Image.Image]:
+    """
+    Маски тени буквы и самой буквы, отрисованные с запасом качества
+    и уменьшенные до целевого размера.
+    """
+    layout = _get_layout(size)
+    font = _get_font(int(layout.render_size * 0.6))
+    center = layout.canvas_size // 2
+    shadow_offset = int(layout.render_size * 0.02)  # 2% от размера
+
+    masks = []
+    for offset in (shadow_offset, 0):
+        mask = Image.new("L", (layout.canvas_size, layout.canvas_size), 0)
+        ImageDraw.Draw(mask).text((center + offset, center + offset), letter, fill=255, font=font, anchor="mm")
+        masks.append(mask.resize((size, size), Image.Resampling.LANCZOS))
+
+    return masks[0], masks[1]
 
 
 def get_user_avatar(nickname: str, size: int = 512) -> Tuple[str, str]:
@@ -371,35 +430,8 @@ def create_avatar(nickname: str, color_hex: str = None, size: int = 512) -> str:
     return avatar_path
 
 
-# Тестируем функцию если файл запущен напрямую
+# Командная строка: python -m utils.avatars prewarm --help
 if __name__ == "__main__":
-    print("=== ТЕСТ АВАТАРОК МАКСИМАЛЬНОГО КАЧЕСТВА ===")
-    print(f"Папка для аватарок: {os.path.abspath(AVATARS_DIR)}")
-
-    test_nicks = ["HappyFox123", "BraveDragon42", "SwiftWolf99"]
-
-    for i, nick in enumerate(test_nicks):
-        # Тестируем кеширование
-        print(f"\n{i + 1}. Тестируем ник: {nick}")
-
-        # Первое создание
-        avatar_path1, color1 = get_user_avatar(nick, size=512)
-        print(f"   Создана аватарка 512x512: {os.path.basename(avatar_path1)}")
-
-        # Второй запрос - должна вернуться из кеша
-        avatar_path2, color2 = get_user_avatar(nick, size=512)
-        print(f"   Из кеша: {os.path.basename(avatar_path2)}")
-        print(f"   Пути совпадают: {avatar_path1 == avatar_path2}")
-
-        # Принудительное пересоздание
-        avatar_path3, color3 = regenerate_user_avatar(nick, size=512)
-        print(f"   Пересоздана: {os.path.basename(avatar_path3)}")
-        print(f"   Цвет: {color1}")
-
-        # Тестируем случайные аватарки
-        avatar_path4, color4 = regenerate_user_avatar_random(nick, size=512)
-        print(f"   Случайная: {os.path.basename(avatar_path4)}")
-        print(f"   Случайный цвет: {color4}")
+    from utils.avatar_prewarm import main
 
-    print(f"\n=== ТЕСТ ЗАВЕРШЕН ===")
-    print("Аватарки сохранены в папке data/avatars/")
\ No newline at end of file
+    main()
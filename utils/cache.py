@@ -0,0 +1,165 @@
+# utils/cache.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Hashable, Iterable, Optional, Set, Tuple
+
+
+class AsyncCache:
+    """
+    Асинхронный read-through кеш с TTL и LRU-вытеснением.
+
+    get(key, loader) отдает значение из памяти, а при промахе вызывает
+    loader(key). Одновременные промахи по одному ключу объединяются
+    в один вызов loader. invalidate сбрасывает ключ; если в этот момент
+    ключ уже загружался, результат той загрузки в кеш не попадет.
+    None тоже кешируется (например, "пользователя нет").
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def get(self, key: Hashable, loader: Callable[[Hashable], Awaitable[Any]]) -> Any:
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+
+        self.misses += 1
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader(key))
+            self._loading[key] = future
+            future.add_done_callback(lambda done: self._on_loaded(key, done))
+
+        # shield: отмена одного ожидающего не отменяет общую загрузку
+        return await asyncio.shield(future)
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Значение из кеша без загрузки и без учета в статистике"""
+        item = self._data.get(key)
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._loading.pop(key, None)
+        self._store(key, value)
+
+    def invalidate(self, key: Hashable):
+        # Идущая загрузка могла прочитать старые данные - следующий get начнет новую
+        self._loading.pop(key, None)
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._loading.clear()
+        self._data.clear()
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / requests, 4) if requests else 0.0,
+        }
+
+    def _on_loaded(self, key: Hashable, future: asyncio.Future):
+        failed = future.cancelled() or future.exception() is not None
+        if self._loading.get(key) is not future:
+            return  # Ключ сбросили, пока шла загрузка
+        del self._loading[key]
+        if not failed:
+            self._store(key, future.result())
+
+    def _store(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+
+class MembershipIndex:
+    """
+    Участники комнат в памяти процесса: комната -> участники и
+    пользователь -> комнаты. Загружается из room_users один раз
+    и дальше обновляется теми же вызовами, что пишут в БД, поэтому
+    проверки членства и счетчики участников не ходят в PostgreSQL.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._room_members: Dict[int, Set[int]] = {}
+        self._user_rooms: Dict[int, Set[int]] = {}
+
+    def load(self, pairs: Iterable[Tuple[int, int]]):
+        """Добавляет пары (user_id, room_id) из БД"""
+        for user_id, room_id in pairs:
+            self.add(user_id, room_id)
+
+    def add(self, user_id: int, room_id: int) -> bool:
+        """Добавляет участника; False, если он уже был в комнате"""
+        members = self._room_members.setdefault(room_id, set())
+        if user_id in members:
+            return False
+        members.add(user_id)
+        self._user_rooms.setdefault(user_id, set()).add(room_id)
+        return True
+
+    def remove(self, user_id: int, room_id: int) -> bool:
+        """Убирает участника; False, если его не было в комнате"""
+        members = self._room_members.get(room_id)
+        if not members or user_id not in members:
+            return False
+
+        members.discard(user_id)
+        if not members:
+            del self._room_members[room_id]
+        rooms = self._user_rooms[user_id]
+        rooms.discard(room_id)
+        if not rooms:
+            del self._user_rooms[user_id]
+        return True
+
+    def contains(self, user_id: int, room_id: int) -> bool:
+        return user_id in self._room_members.get(room_id, ())
+
+    def members(self, room_id: int) -> FrozenSet[int]:
+        return frozenset(self._room_members.get(room_id, ()))
+
+    def rooms(self, user_id: int) -> FrozenSet[int]:
+        return frozenset(self._user_rooms.get(user_id, ()))
+
+    def room_count(self, room_id: int) -> int:
+        """Количество участников комнаты"""
+        return len(self._room_members.get(room_id, ()))
+
+    def user_rooms_count(self, user_id: int) -> int:
+        """Количество комнат пользователя"""
+        return len(self._user_rooms.get(user_id, ()))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rooms": len(self._room_members),
+            "users": len(self._user_rooms),
+            "memberships": sum(map(len, self._room_members.values())),
+        }
@@ -1,8 +1,21 @@
 # utils/nick_generator.py
+import bisect
+import hashlib
 import random
+from collections import Counter
+from functools import cached_property
+from math import prod
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
-# Расширенные списки для генерации креативных ников
-ADJECTIVES = [
+
+def _unique(words: Iterable[str]) -> Tuple[str, ...]:
+    """Неизменяемая таблица слов без повторов (порядок первого появления сохраняется)"""
+    return tuple(dict.fromkeys(words))
+
+
+# Расширенные списки для генерации креативных ников.
+# Все словари - кортежи без повторов, чтобы выбор по индексу был равномерным
+ADJECTIVES = _unique([
     # Основные прилагательные
     "Happy", "Swift", "Clever", "Brave", "Calm", "Daring", "Eager", "Gentle",
     "Jolly", "Lucky", "Mighty", "Proud", "Silent", "Witty", "Young", "Bright",
@@ -31,9 +44,9 @@ ADJECTIVES = [
     # Абстрактные понятия
     "Abstract", "Chaos", "Dream", "Echo", "Infinite", "Nova", "Omega", "Prime",
     "Random", "Secret", "Ultimate", "Velocity", "Zen", "Alpha", "Omega"
-]
+])
 
-NOUNS = [
+NOUNS = _unique([
     # Животные и существа
     "Fox", "Wolf", "Eagle", "Lion", "Tiger", "Bear", "Hawk", "Shark", "Dragon",
     "Falcon", "Owl", "Panther", "Rabbit", "Deer", "Horse", "Whale", "Phoenix",
@@ -73,191 +86,585 @@ NOUNS = [
     "Blade", "Sword", "Shield", "Bow", "Arrow", "Axe", "Hammer", "Spear",
     "Dagger", "Staff", "Wand", "Orb", "Crystal", "Amulet", "Talisman", "Relic",
     "Artifact", "Treasure", "Gold", "Silver", "Diamond", "Ruby", "Emerald"
-]
+])
 
 # Специализированные тематические наборы
-TECH_NOUNS = [
+TECH_NOUNS = _unique([
     "Algorithm", "Blockchain", "Firewall", "Framework", "Function", "Hash",
     "Iterator", "Kernel", "Lambda", "Matrix", "Network", "Protocol", "Query",
     "Script", "Syntax", "Template", "Variable", "Vector", "Zip", "Cache"
-]
+])
 
-MYTHICAL_NOUNS = [
+MYTHICAL_NOUNS = _unique([
     "Basilisk", "Cerberus", "Chimera", "Fenrir", "Griffin", "Hippogriff",
     "Kraken", "Leviathan", "Phoenix", "Sphinx", "Thunderbird", "Wyvern",
     "Zombie", "Golem", "Banshee", "Doppelganger", "Ghost", "Poltergeist"
-]
+])
 
-SPACE_NOUNS = [
+SPACE_NOUNS = _unique([
     "Asteroid", "BlackHole", "Comet", "Constellation", "Crater", "Eclipse",
     "Galaxy", "Meteor", "Nebula", "Orbit", "Planet", "Quasar", "Rocket",
     "Satellite", "Supernova", "Telescope", "Universe", "Wormhole"
-]
+])
 
-FANTASY_NOUNS = [
+FANTASY_NOUNS = _unique([
     "Amulet", "Castle", "Dungeon", "Elixir", "Forest", "Goblin", "Hydra",
     "Island", "Jewel", "Kingdom", "Labyrinth", "Monster", "Necromancer",
     "Obelisk", "Portal", "Quest", "Ruins", "Spell", "Tower", "Undead"
-]
+])
 
-GAMING_NOUNS = [
+GAMING_NOUNS = _unique([
     "Avatar", "Boss", "Character", "Damage", "Experience", "Game", "Health",
     "Item", "Jump", "Kill", "Level", "Mission", "NPC", "Quest", "Rank",
     "Skill", "Target", "Upgrade", "Victory", "Weapon", "XP", "Zone"
-]
+])
 
 # Дополнительные прилагательные для комбинаций
-PREFIXES = [
+PREFIXES = _unique([
     "Alpha", "Beta", "Gamma", "Delta", "Omega", "Sigma", "Theta", "Zeta",
     "Cyber", "Hyper", "Mega", "Super", "Ultra", "Multi", "Omni", "Poly",
     "Neo", "Proto", "Retro", "Techno", "Digital", "Virtual", "Quantum"
-]
+])
 
-SUFFIXES = [
+SUFFIXES = _unique([
     "Master", "Lord", "King", "Queen", "Prince", "Princess", "Warrior", "Mage",
     "Expert", "Pro", "Elite", "Legend", "Champion", "Hero", "Veteran", "Novice",
     "Builder", "Maker", "Creator", "Designer", "Artist", "Writer", "Coder"
-]
+])
 
 
-def generate_nickname() -> str:
+# Тематические существительные и эпитеты по умолчанию
+THEME_NOUNS: Dict[str, Tuple[str, ...]] = {
+    "tech": TECH_NOUNS,
+    "space": SPACE_NOUNS,
+    "fantasy": FANTASY_NOUNS,
+    "gaming": GAMING_NOUNS,
+    "mythical": MYTHICAL_NOUNS,
+}
+
+THEME_ADJECTIVES: Dict[str, Tuple[str, ...]] = {
+    "tech": ("Cyber", "Net"),
+    "space": ("Cosmic", "Star"),
+    "fantasy": ("Magic", "Dragon"),
+    "gaming": ("Game", "Player"),
+    "mythical": ("Ancient", "Mythic"),
+}
+
+NICK_SYMBOLS = ("X", "Z", "Pro", "Max", "HD", "VR", "AI")
+MAX_NICKNAME_LENGTH = 20
+
+
+class NickScheme:
     """
-    Генерирует случайный никнейм с улучшенной логикой комбинирования.
-    Примеры: "QuantumShadow", "NeonDragon42", "CyberPhoenix", "MysticTraveler"
+    Схема ника: декартово произведение таблиц частей.
 
-    Returns:
-        str: Сгенерированный никнейм
+    Каждый ник схемы адресуется целым индексом в диапазоне [0, size),
+    поэтому выбор ника - это одно число, без сборки промежуточных списков.
+    При no_repeats две части из одной таблицы не могут совпадать.
     """
-    # Выбираем основную схему генерации
-    scheme = random.choice([
-        "adjective_noun",  # Прилагательное + Существительное
-        "prefix_noun",  # Префикс + Существительное
-        "adjective_suffix",  # Прилагательное + Суффикс
-        "theme_noun",  # Тематическое существительное
-        "double_adjective",  # Двойное прилагательное
-        "mythical_creature"  # Мифическое существо
-    ])
-
-    if scheme == "adjective_noun":
-        adjective = random.choice(ADJECTIVES)
-        noun = random.choice(NOUNS)
-        nickname = f"{adjective}{noun}"
-
-    elif scheme == "prefix_noun":
-        prefix = random.choice(PREFIXES)
-        noun = random.choice(NOUNS)
-        nickname = f"{prefix}{noun}"
-
-    elif scheme == "adjective_suffix":
-        adjective = random.choice(ADJECTIVES)
-        suffix = random.choice(SUFFIXES)
-        nickname = f"{adjective}{suffix}"
-
-    elif scheme == "theme_noun":
-        # Выбираем тематическую группу
-        theme = random.choice(["tech", "space", "fantasy", "gaming", "mythical"])
-        if theme == "tech":
-            noun = random.choice(TECH_NOUNS)
-        elif theme == "space":
-            noun = random.choice(SPACE_NOUNS)
-        elif theme == "fantasy":
-            noun = random.choice(FANTASY_NOUNS)
-        elif theme == "gaming":
-            noun = random.choice(GAMING_NOUNS)
-        else:
-            noun = random.choice(MYTHICAL_NOUNS)
 
-        # Добавляем прилагательное с вероятностью 70%
-        if random.random() < 0.7:
-            adjective = random.choice(ADJECTIVES)
-            nickname = f"{adjective}{noun}"
-        else:
-            nickname = noun
-
-    elif scheme == "double_adjective":
-        adj1 = random.choice(ADJECTIVES)
-        adj2 = random.choice(ADJECTIVES)
-        while adj2 == adj1:  # Избегаем повторений
-            adj2 = random.choice(ADJECTIVES)
-        nickname = f"{adj1}{adj2}"
-
-    else:  # mythical_creature
-        creature = random.choice(MYTHICAL_NOUNS)
-        # Добавляем эпитет с вероятностью 60%
-        if random.random() < 0.6:
-            adjective = random.choice(ADJECTIVES)
-            nickname = f"{adjective}{creature}"
-        else:
-            nickname = creature
-
-    # Добавляем число с вероятностью 40%
-    if random.random() < 0.4:
-        # Выбираем формат числа
-        number_format = random.choice([
-            lambda: random.randint(1, 999),  # 42
-            lambda: random.randint(1000, 9999),  # 2042
-            lambda: random.randint(1970, 2025),  # 2023
-            lambda: int(str(random.randint(1, 99)) + str(random.randint(0, 99))),  # 1337
-        ])
-        number = number_format()
-        nickname = f"{nickname}{number}"
-
-    # Иногда добавляем специальные символы (10% случаев)
-    if random.random() < 0.1:
-        symbol = random.choice(["X", "Z", "Pro", "Max", "HD", "VR", "AI"])
-        nickname = f"{nickname}{symbol}"
-
-    # Обеспечиваем длину никнейма в пределах 3-20 символов
-    if len(nickname) > 20:
-        nickname = nickname[:20]
-    elif len(nickname) < 3:
-        nickname = nickname + str(random.randint(10, 99))
-
-    return nickname
+    def __init__(self, name: str, *tables: Sequence[str], no_repeats: bool = False):
+        if no_repeats and (len(tables) != 2 or tables[0] is not tables[1]):
+            raise ValueError("no_repeats поддерживается только для двух одинаковых таблиц")
+
+        self.name = name
+        self.tables = tables
+        self.no_repeats = no_repeats
+        self.size = len(tables[0]) * (len(tables[0]) - 1) if no_repeats else prod(len(table) for table in tables)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"NickScheme({self.name!r}, size={self.size})"
+
+    def nickname_at(self, index: int) -> str:
+        """Ник с заданным индексом"""
+        if not 0 <= index < self.size:
+            raise IndexError(f"Индекс {index} вне схемы {self.name} (размер {self.size})")
+
+        if self.no_repeats:
+            first, second = divmod(index, len(self.tables[0]) - 1)
+            if second >= first:
+                second += 1
+            return self.tables[0][first] + self.tables[0][second]
+
+        nickname = ""
+        for table in reversed(self.tables):
+            index, part = divmod(index, len(table))
+            nickname = table[part] + nickname
+        return nickname
+
+    def random_nickname(self, rng: random.Random = random) -> str:
+        return self.nickname_at(rng.randrange(self.size))
+
+    @cached_property
+    def distinct_count(self) -> int:
+        """
+        Сколько разных ников допустимой длины дает схема.
+        Бывает меньше size: разные наборы частей могут склеиться в одну строку.
+        """
+        return len({
+            nickname for nickname in map(self.nickname_at, range(self.size))
+            if len(nickname) <= MAX_NICKNAME_LENGTH
+        })
+
+
+# Пустая строка в таблице делает часть необязательной
+_OPTIONAL_ADJECTIVES = ("",) + ADJECTIVES
+
+SCHEMES: Dict[str, NickScheme] = {
+    scheme.name: scheme for scheme in (
+        NickScheme("adjective_noun", ADJECTIVES, NOUNS),
+        NickScheme("prefix_noun", PREFIXES, NOUNS),
+        NickScheme("adjective_suffix", ADJECTIVES, SUFFIXES),
+        NickScheme("theme_noun", _OPTIONAL_ADJECTIVES, _unique(noun for nouns in THEME_NOUNS.values() for noun in nouns)),
+        NickScheme("double_adjective", ADJECTIVES, ADJECTIVES, no_repeats=True),
+        NickScheme("mythical_creature", _OPTIONAL_ADJECTIVES, MYTHICAL_NOUNS),
+    )
+}
+
+THEME_SCHEMES: Dict[str, NickScheme] = {
+    theme: NickScheme(theme, _unique(ADJECTIVES + THEME_ADJECTIVES[theme]), nouns)
+    for theme, nouns in THEME_NOUNS.items()
+}
+
+
+def get_scheme_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Емкость каждой схемы и темы: size - число комбинаций частей,
+    distinct - число разных ников допустимой длины (без числа и символа)
+    """
+    return {
+        name: {"size": scheme.size, "distinct": scheme.distinct_count}
+        for name, scheme in {**SCHEMES, **{f"theme:{theme}": scheme for theme, scheme in THEME_SCHEMES.items()}}.items()
+    }
 
 
-def generate_themed_nickname(theme: str) -> str:
+class TakenNicknames:
     """
-    Генерирует никнейм определенной тематики.
+    Компактное множество занятых ников.
 
-    Args:
-        theme: tech, space, fantasy, gaming, mythical
+    Хранит 64-битные хэши вместо строк. Совпадение хэшей двух разных ников
+    может только отсеять свободный ник, но никогда не пропустит занятый.
+    Ник в users не уникален, поэтому для каждого хэша хранится число
+    владельцев: discard освобождает ник, только когда их не осталось.
+    """
 
-    Returns:
-        str: Тематический никнейм
+    def __init__(self, nicknames: Iterable[str] = ()):
+        self._hashes: Counter = Counter()
+        self.update(nicknames)
+
+    @staticmethod
+    def _hash(nickname: str) -> int:
+        return int.from_bytes(hashlib.blake2b(nickname.encode(), digest_size=8).digest(), "big")
+
+    def __contains__(self, nickname: str) -> bool:
+        return self._hash(nickname) in self._hashes
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, nickname: str):
+        self._hashes[self._hash(nickname)] += 1
+
+    def discard(self, nickname: str):
+        key = self._hash(nickname)
+        if self._hashes[key] > 1:
+            self._hashes[key] -= 1
+        else:
+            self._hashes.pop(key, None)
+
+    def update(self, nicknames: Iterable[str]):
+        self._hashes.update(self._hash(nickname) for nickname in nicknames)
+
+    def clear(self):
+        self._hashes.clear()
+
+    async def load(self, db, batch_size: int = 5000):
+        """Загружает все ники из таблицы users"""
+        async for users in db.iter_users(batch_size):
+            self.update(user["nickname"] for user in users)
+
+
+class NickSpace:
     """
-    themes = {
-        "tech": (TECH_NOUNS, "Cyber", "Net"),
-        "space": (SPACE_NOUNS, "Cosmic", "Star"),
-        "fantasy": (FANTASY_NOUNS, "Magic", "Dragon"),
-        "gaming": (GAMING_NOUNS, "Game", "Player"),
-        "mythical": (MYTHICAL_NOUNS, "Ancient", "Mythic")
-    }
+    Пространство всех ников вида <основа><число><символ> с нумерацией без пропусков.
+
+    Основы - разные ники всех схем из SCHEMES, отсортированные по длине,
+    число - пусто или 1..9999, символ - пусто или один из NICK_SYMBOLS.
+    Комбинации сгруппированы по длине числа и символа, и в каждой группе
+    берутся только основы, с которыми ник укладывается в 20 символов.
+    Строки, которые можно склеить несколькими способами (основа "Ghost" +
+    символ "Pro" и основа "GhostPro"), учитываются один раз - по минимальному
+    индексу, остальные индексы пропускаются.
+    """
+
+    def __init__(self):
+        names = set()
+        for scheme in SCHEMES.values():
+            names.update(
+                nickname for nickname in map(scheme.nickname_at, range(scheme.size))
+                if len(nickname) <= MAX_NICKNAME_LENGTH
+            )
+
+        self.bases = tuple(sorted(names, key=lambda name: (len(name), name)))
+        self.base_index = {name: index for index, name in enumerate(self.bases)}
+        lengths = [len(name) for name in self.bases]
+
+        symbols_by_length: Dict[int, List[str]] = {}
+        for symbol in ("",) + NICK_SYMBOLS:
+            symbols_by_length.setdefault(len(symbol), []).append(symbol)
+
+        # Группа: (цифр в числе, символы одной длины, сколько основ помещается, смещение)
+        self._groups = []
+        self._symbol_position: Dict[str, Tuple[int, int]] = {}
+        offset = 0
+        for digits in range(5):
+            for symbol_length, symbols in sorted(symbols_by_length.items()):
+                limit = MAX_NICKNAME_LENGTH - digits - symbol_length
+                bases_count = bisect.bisect_right(lengths, limit)
+                numbers_count = 1 if digits == 0 else 9 * 10 ** (digits - 1)
+                self._groups.append((digits, tuple(symbols), bases_count, numbers_count, offset))
+                offset += bases_count * numbers_count * len(symbols)
+        self._group_offsets = [group[4] for group in self._groups]
+        self._group_lookup = {(group[0], len(group[1][0])): group for group in self._groups}
+        total = offset
+
+        # Индексы-дубликаты возможны только без числа: цифры однозначно делят строку.
+        # Строка склеивается двумя способами, только если основа оканчивается
+        # началом более длинного символа, а остаток основы - тоже основа
+        # ("GhostPro" = "Ghost" + "Pro"), поэтому проверяем лишь такие основы
+        splits = [
+            (symbol, longer[:len(longer) - len(symbol)])
+            for symbol in ("",) + NICK_SYMBOLS for longer in NICK_SYMBOLS
+            if len(longer) > len(symbol) and longer.endswith(symbol)
+        ]
+        holes = set()
+        for base in self.bases:
+            for symbol, head in splits:
+                nickname = base + symbol
+                if (len(nickname) > MAX_NICKNAME_LENGTH or not base.endswith(head)
+                        or base[:len(base) - len(head)] not in self.base_index):
+                    continue
+                best = self.index_of(nickname)
+                holes.update(index for index in self._split_indexes(nickname) if index != best)
+
+        self.holes = sorted(holes)
+        self.size = total - len(self.holes)
+
+    def nickname_at(self, position: int) -> str:
+        """Ник по порядковому номеру в [0, size)"""
+        if not 0 <= position < self.size:
+            raise IndexError(f"Номер {position} вне пространства ников (размер {self.size})")
+
+        # Номер -> индекс с учетом пропущенных дубликатов
+        index = position
+        for hole in self.holes:
+            if hole > index:
+                break
+            index += 1
+
+        group = self._groups[bisect.bisect_right(self._group_offsets, index) - 1]
+        digits, symbols, _, numbers_count, offset = group
+        base, rest = divmod(index - offset, numbers_count * len(symbols))
+        number, symbol = divmod(rest, len(symbols))
+
+        number_part = str(10 ** (digits - 1) + number) if digits else ""
+        return self.bases[base] + number_part + symbols[symbol]
+
+    def position_of(self, nickname: str) -> Optional[int]:
+        """Порядковый номер ника или None, если ник не из этого пространства"""
+        index = self.index_of(nickname)
+        if index is None:
+            return None
+        return index - bisect.bisect_left(self.holes, index)
+
+    def index_of(self, nickname: str) -> Optional[int]:
+        """Минимальный индекс среди всех способов склеить ник"""
+        return min(self._split_indexes(nickname), default=None)
+
+    def _split_indexes(self, nickname: str) -> List[int]:
+        """Индексы всех способов склеить ник из основы, числа и символа"""
+        indexes = []
+        for symbol in ("",) + NICK_SYMBOLS:
+            if symbol and not nickname.endswith(symbol):
+                continue
+
+            rest = nickname[:len(nickname) - len(symbol)]
+            base = rest.rstrip("0123456789")
+            number = rest[len(base):]
+            if number.startswith("0") or len(number) > 4 or base not in self.base_index:
+                continue
+
+            indexes.append(self._index(self.base_index[base], number, symbol))
+        return indexes
+
+    def _index(self, base: int, number: str, symbol: str) -> int:
+        digits, symbols, _, numbers_count, offset = self._group_lookup[(len(number), len(symbol))]
+        number_index = int(number) - 10 ** (len(number) - 1) if number else 0
+        return offset + (base * numbers_count + number_index) * len(symbols) + symbols.index(symbol)
+
+
+_nick_space: Optional[NickSpace] = None
+
+
+def get_nick_space() -> NickSpace:
+    """Общее пространство ников (строится при первом обращении, около 0.2 с)"""
+    global _nick_space
+    if _nick_space is None:
+        _nick_space = NickSpace()
+    return _nick_space
+
+
+class NickGenerator:
+    """
+    Генератор ников с собственным источником случайности.
+
+    С одинаковым seed выдает одинаковую последовательность ников.
+    from_id взаимно однозначно отображает число (счетчик, номер
+    пользователя) в ник через перестановку пространства ников, заданную
+    ключом: разные числа всегда дают разные ники, одно число - всегда
+    один и тот же ник. Несколько экземпляров бота с одним ключом делят
+    пространство без координации через БД (см. from_counter).
+
+    Пространство ников вмещает около 3.2 млрд значений (меньше 2^32),
+    поэтому Telegram user_id (64-битные, уже больше 7 млрд) напрямую
+    в from_id не подходят - передавайте порядковый номер пользователя
+    или счетчик экземпляра.
+    """
+
+    FEISTEL_ROUNDS = 6
+
+    def __init__(self, seed: Optional[int] = None, key: bytes = b"NOIS"):
+        self.random = random.Random(seed)
+        self.key = key
+
+    # ===== СЛУЧАЙНАЯ ГЕНЕРАЦИЯ =====
+
+    def generate_random(self) -> str:
+        """
+        Генерирует случайный никнейм с улучшенной логикой комбинирования.
+        Примеры: "QuantumShadow", "NeonDragon42", "CyberPhoenix", "MysticTraveler"
+
+        Returns:
+            str: Сгенерированный никнейм
+        """
+        rng = self.random
 
-    if theme not in themes:
-        return generate_nickname()
+        # Выбираем основную схему генерации
+        scheme = rng.choice((
+            "adjective_noun",  # Прилагательное + Существительное
+            "prefix_noun",  # Префикс + Существительное
+            "adjective_suffix",  # Прилагательное + Суффикс
+            "theme_noun",  # Тематическое существительное
+            "double_adjective",  # Двойное прилагательное
+            "mythical_creature"  # Мифическое существо
+        ))
 
-    nouns, default_adj1, default_adj2 = themes[theme]
+        if scheme == "theme_noun":
+            # Выбираем тематическую группу
+            noun = rng.choice(THEME_NOUNS[rng.choice(tuple(THEME_NOUNS))])
 
-    # Выбираем схему для тематического ника
-    scheme = random.choice([1, 2, 3])
+            # Добавляем прилагательное с вероятностью 70%
+            nickname = f"{rng.choice(ADJECTIVES)}{noun}" if rng.random() < 0.7 else noun
 
-    if scheme == 1:
-        # Прилагательное + Тематическое существительное
-        adjective = random.choice(ADJECTIVES + [default_adj1, default_adj2])
-        noun = random.choice(nouns)
-        nickname = f"{adjective}{noun}"
-    elif scheme == 2:
-        # Тематическое существительное + число
-        noun = random.choice(nouns)
-        nickname = f"{noun}{random.randint(1, 999)}"
-    else:
-        # Двойное тематическое
-        part1 = random.choice([default_adj1, default_adj2, random.choice(ADJECTIVES)])
-        part2 = random.choice(nouns)
-        nickname = f"{part1}{part2}"
+        elif scheme == "mythical_creature":
+            creature = rng.choice(MYTHICAL_NOUNS)
 
-    return nickname
+            # Добавляем эпитет с вероятностью 60%
+            nickname = f"{rng.choice(ADJECTIVES)}{creature}" if rng.random() < 0.6 else creature
+
+        else:
+            nickname = SCHEMES[scheme].random_nickname(rng)
+
+        # Добавляем число с вероятностью 40%
+        if rng.random() < 0.4:
+            # Выбираем формат числа: 42, 2042, 2023 или 1337
+            number_format = rng.randrange(4)
+            if number_format == 0:
+                number = rng.randint(1, 999)
+            elif number_format == 1:
+                number = rng.randint(1000, 9999)
+            elif number_format == 2:
+                number = rng.randint(1970, 2025)
+            else:
+                number = int(str(rng.randint(1, 99)) + str(rng.randint(0, 99)))
+            nickname = f"{nickname}{number}"
+
+        # Иногда добавляем специальные символы (10% случаев)
+        if rng.random() < 0.1:
+            nickname = f"{nickname}{rng.choice(NICK_SYMBOLS)}"
+
+        # Обеспечиваем длину никнейма в пределах 3-20 символов
+        if len(nickname) > MAX_NICKNAME_LENGTH:
+            nickname = nickname[:MAX_NICKNAME_LENGTH]
+        elif len(nickname) < 3:
+            nickname = nickname + str(rng.randint(10, 99))
+
+        return nickname
+
+    def generate_themed(self, theme: str) -> str:
+        """
+        Генерирует никнейм определенной тематики.
+
+        Args:
+            theme: tech, space, fantasy, gaming, mythical
+
+        Returns:
+            str: Тематический никнейм
+        """
+        if theme not in THEME_SCHEMES:
+            return self.generate_random()
+
+        rng = self.random
+        nouns = THEME_NOUNS[theme]
+
+        # Выбираем схему для тематического ника
+        scheme = rng.choice((1, 2, 3))
+
+        if scheme == 1:
+            # Прилагательное + Тематическое существительное
+            nickname = THEME_SCHEMES[theme].random_nickname(rng)
+        elif scheme == 2:
+            # Тематическое существительное + число
+            noun = rng.choice(nouns)
+            nickname = f"{noun}{rng.randint(1, 999)}"
+        else:
+            # Двойное тематическое: эпитет темы в 2 случаях из 3
+            if rng.random() < 2 / 3:
+                part1 = rng.choice(THEME_ADJECTIVES[theme])
+            else:
+                part1 = rng.choice(ADJECTIVES)
+            part2 = rng.choice(nouns)
+            nickname = f"{part1}{part2}"
+
+        return nickname
+
+    def generate_multiple(self, count: int = 5, theme: Optional[str] = None) -> List[str]:
+        """Несколько вариантов ников для выбора"""
+        if theme:
+            return [self.generate_themed(theme) for _ in range(count)]
+        return [self.generate_random() for _ in range(count)]
+
+    def generate_unique(self, count: int, taken: TakenNicknames, theme: Optional[str] = None) -> List[str]:
+        """
+        Генерирует пачку ников, которых нет среди занятых, без запросов к БД.
+
+        Предложенные ники не резервируются: занятым становится только
+        выбранный, когда его записывают Database.create_user или
+        update_user_nickname.
+
+        Args:
+            count: Количество ников
+            taken: Множество занятых ников
+            theme: Тематика (tech, space, fantasy, gaming, mythical) или None
+
+        Returns:
+            list: Уникальные свободные ники (меньше count, только если пространство ников исчерпано)
+        """
+        rng = self.random
+        schemes = [THEME_SCHEMES[theme]] if theme in THEME_SCHEMES else list(SCHEMES.values())
+
+        nicks = []
+        seen = set()
+        for _ in range(10):
+            missing = count - len(nicks)
+            if missing <= 0:
+                break
+
+            # Кандидатов берем с запасом, чтобы обычно хватало одного прохода
+            for scheme in rng.choices(schemes, k=missing * 2):
+                nick = scheme.random_nickname(rng)
+                if rng.random() < 0.4:
+                    nick += str(rng.randint(1, 9999))
+                if rng.random() < 0.1:
+                    nick += rng.choice(NICK_SYMBOLS)
+
+                if len(nick) > MAX_NICKNAME_LENGTH or nick in seen or nick in taken:
+                    continue
+                seen.add(nick)
+                nicks.append(nick)
+                if len(nicks) == count:
+                    break
+
+        return nicks
+
+    # ===== ДЕТЕРМИНИРОВАННАЯ ВЫДАЧА =====
+
+    @property
+    def capacity(self) -> int:
+        """Сколько разных ников может выдать from_id"""
+        return get_nick_space().size
+
+    def from_id(self, value: int) -> str:
+        """
+        Ник для числа из [0, capacity). Разные числа - разные ники.
+        capacity около 3.2 млрд - это не Telegram user_id, а номер или счетчик.
+
+        Raises:
+            ValueError: Число вне пространства ников
+        """
+        space = get_nick_space()
+        if not 0 <= value < space.size:
+            raise ValueError(f"Значение {value} вне пространства ников [0, {space.size})")
+        return space.nickname_at(self._permute(value, space.size))
+
+    def from_counter(self, counter: int, worker: int = 0, workers: int = 1) -> str:
+        """
+        Ник для локального счетчика экземпляра: экземпляр worker из workers
+        использует числа worker, worker + workers, ... и не пересекается с другими.
+        """
+        return self.from_id(counter * workers + worker)
+
+    def to_id(self, nickname: str) -> Optional[int]:
+        """Обратное к from_id: число, которому соответствует ник, или None"""
+        space = get_nick_space()
+        position = space.position_of(nickname)
+        if position is None:
+            return None
+        return self._permute(position, space.size, inverse=True)
+
+    def _permute(self, value: int, size: int, inverse: bool = False) -> int:
+        """Перестановка [0, size): сеть Фейстеля на ближайшей степени двойки и cycle-walking"""
+        half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        mask = (1 << half_bits) - 1
+
+        while True:
+            left, right = value >> half_bits, value & mask
+            if inverse:
+                for round_index in reversed(range(self.FEISTEL_ROUNDS)):
+                    left, right = right ^ self._round(round_index, left, mask), left
+            else:
+                for round_index in range(self.FEISTEL_ROUNDS):
+                    left, right = right, left ^ self._round(round_index, right, mask)
+            value = (left << half_bits) | right
+            if value < size:
+                return value
+
+    def _round(self, round_index: int, half: int, mask: int) -> int:
+        digest = hashlib.blake2b(half.to_bytes(8, "big"), digest_size=8, key=self.key,
+                                 salt=round_index.to_bytes(16, "big")).digest()
+        return int.from_bytes(digest, "big") & mask
+
+
+# Генератор по умолчанию для функций модуля
+_default_generator = NickGenerator()
+
+
+def generate_unique_nicks(count: int, taken: TakenNicknames, theme: Optional[str] = None) -> List[str]:
+    """Пачка свободных ников (см. NickGenerator.generate_unique)"""
+    return _default_generator.generate_unique(count, taken, theme)
+
+
+def generate_nickname() -> str:
+    """Случайный никнейм (см. NickGenerator.generate_random)"""
+    return _default_generator.generate_random()
+
+
+def generate_themed_nickname(theme: str) -> str:
+    """Тематический никнейм (см. NickGenerator.generate_themed)"""
+    return _default_generator.generate_themed(theme)
 
 
 def generate_multiple_nicks(count: int = 5, theme: str = None) -> list:
@@ -271,14 +678,7 @@ def generate_multiple_nicks(count: int = 5, theme: str = None) -> list:
     Returns:
         list: Список никнеймов
     """
-    nicks = []
-    for _ in range(count):
-        if theme:
-            nick = generate_themed_nickname(theme)
-        else:
-            nick = generate_nickname()
-        nicks.append(nick)
-    return nicks
+    return _default_generator.generate_multiple(count, theme)
 
 
 def get_nickname_themes() -> list:
@@ -311,6 +711,14 @@ if __name__ == "__main__":
     for i, nick in enumerate(generate_multiple_nicks(5, "gaming"), 1):
         print(f"{i}. {nick}")
 
+    print("\n📐 Емкость схем (комбинаций / разных ников):")
+    for name, stats in get_scheme_stats().items():
+        print(f"   {name}: {stats['size']} / {stats['distinct']}")
+
     print(f"\n📊 Всего вариантов прилагательных: {len(ADJECTIVES)}")
     print(f"📊 Всего вариантов существительных: {len(NOUNS)}")
-    print(f"🎯 Доступные тематики: {', '.join(get_nickname_themes())}")
\ No newline at end of file
+    print(f"🎯 Доступные тематики: {', '.join(get_nickname_themes())}")
+    generator = NickGenerator(seed=42)
+    print(f"\n🔢 Детерминированная выдача: {generator.capacity} ников")
+    for i in range(3):
+        print(f"   {i} -> {generator.from_id(i)}")